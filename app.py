@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import signal
 
 import tornado.httpserver
 import tornado.web
@@ -7,15 +8,31 @@ from tornado.options import options
 
 from core.address import Address
 from core.local import Local
-from handlers.chord import ChordHandler
+from core.stream import stream_port
+from handlers.chord import ChordHandler, ChordStreamServer
+from handlers.metrics import MetricsHandler
+from handlers.traces import TracesHandler
 from settings import settings
 from urls import url_patterns
 
 
 class PlayStackTornado(tornado.web.Application):
     def __init__(self, node):
-        url_patterns.append((r"/chord/", ChordHandler, {'node': node}))
-        tornado.web.Application.__init__(self, url_patterns, **settings)
+        handlers = url_patterns + [
+            (r"/chord/", ChordHandler, {'node': node}),
+            (r"/metrics/?", MetricsHandler, {'node': node}),
+            (r"/traces/?", TracesHandler),
+        ]
+        tornado.web.Application.__init__(self, handlers, **settings)
+
+
+async def leave(node):
+    # hand our keys and neighbours over before going away
+    try:
+        await node.leave()
+    finally:
+        node.store.close()
+        IOLoop.current().stop()
 
 
 def main():
@@ -28,7 +45,11 @@ def main():
     app = PlayStackTornado(node=node)
     http_server = tornado.httpserver.HTTPServer(app)
     http_server.listen(options.port)
+    if options.transport == 'tcp':
+        stream_server = ChordStreamServer(node)
+        stream_server.listen(stream_port(node.address))
     node.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: IOLoop.current().add_callback_from_signal(leave, node))
     IOLoop.current().start()
 
 
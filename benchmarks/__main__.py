@@ -0,0 +1,66 @@
+"""Runs the benchmark over a grid of ring sizes, LOGSIZE values and
+transports and writes every report into one JSON document, e.g.
+
+    python -m benchmarks --nodes=16,64,256 --logsize=16,32 --transport=loopback,tcp --output=bench.json
+
+Unknown arguments are handed to every run, e.g. --lookup=recursive.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def values(kind):
+    return lambda text: [kind(value) for value in text.split(',')]
+
+
+def run(nodes, logsize, transport, args, extra):
+    command = [sys.executable, '-m', 'benchmarks.cluster', f'--logsize={logsize}', f'--transport={transport}',
+               f'--sim_nodes={nodes}', f'--sim_duration={args.duration}', f'--sim_lookups={args.lookups}',
+               f'--sim_seed={args.seed}'] + extra
+    output = subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    # settings print while they are imported, the report comes last
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--nodes', type=values(int), default=[16, 64], help='ring sizes, comma separated')
+    parser.add_argument('--logsize', type=values(int), default=[32], help='LOGSIZE values, comma separated')
+    parser.add_argument('--transport', type=values(str), default=['loopback'],
+                        help="transports, comma separated, 'loopback', 'http' or 'tcp'")
+    parser.add_argument('--duration', type=float, default=10, help='seconds of quiet ring to measure maintenance on')
+    parser.add_argument('--lookups', type=int, default=500, help='lookups per run')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of every run')
+    parser.add_argument('--output', default=None, help='file to write the results to, stdout by default')
+    args, extra = parser.parse_known_args()
+
+    results = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'arguments': sys.argv[1:],
+        'runs': [],
+    }
+    for nodes, logsize, transport in itertools.product(args.nodes, args.logsize, args.transport):
+        print(f'benchmarking {nodes} nodes, LOGSIZE {logsize} over {transport}', file=sys.stderr)
+        results['runs'].append(run(nodes, logsize, transport, args, extra))
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+
+if __name__ == "__main__":
+    main()
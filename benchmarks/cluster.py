@@ -0,0 +1,230 @@
+"""Benchmarks one ring configuration and prints the report as JSON.
+
+LOGSIZE is fixed once settings are imported, so every configuration runs
+in a process of its own. Takes the simulator's options, e.g.
+
+    python -m benchmarks.cluster --logsize=32 --transport=tcp --sim_nodes=64
+
+The loopback transport runs in virtual time with the simulated latency,
+http and tcp rings serve on localhost ports and run on the wall clock.
+The report is the last line printed.
+"""
+import asyncio
+import json
+import logging
+import resource
+import time
+from collections import Counter
+
+from tornado import gen
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.options import options
+
+from app import PlayStackTornado
+from core.address import Address
+from core.exceptions import ChordError
+from core.metrics import RPC_ATTEMPTS
+from core.stream import stream_port
+from core.utils import CommandType
+from handlers.chord import ChordStreamServer
+from settings import LOGSIZE, SIZE
+from simulator import Simulator, VirtualTimeIOLoop, VirtualTimeLoop
+
+# a hop is a node asked where to go next
+ROUTING_COMMANDS = (CommandType.FIND_SUCCESSOR, CommandType.FIND_SUCCESSORS_BATCH,
+                    CommandType.CLOSEST_PRECEDING_FINGER)
+
+# first localhost port of a socket ring, tcp rings must stay below
+# STREAM_PORT_OFFSET nodes
+BASE_PORT = 20000
+
+# daemons of a freshly built ring start within a second
+SETTLE_TIME = 2
+CONVERGENCE_TIMEOUT = 120
+POLL_INTERVAL = 0.1
+
+
+# the simulator's ring with every node serving on a localhost port
+class SocketRing(Simulator):
+    def __init__(self, seed=None):
+        transport = options.transport
+        super().__init__(seed=seed)
+        options.transport = transport
+        self.servers = {}
+
+    def address(self, i):
+        return Address('127.0.0.1', BASE_PORT + i)
+
+    def listen(self, node):
+        http_server = HTTPServer(PlayStackTornado(node=node))
+        http_server.listen(node.address.port)
+        self.servers[node.address] = [http_server]
+
+        if options.transport == 'tcp':
+            stream_server = ChordStreamServer(node)
+            stream_server.listen(stream_port(node.address))
+            self.servers[node.address].append(stream_server)
+
+    def close(self, node):
+        # a dead node also drops the connections peers keep open to it
+        for server in self.servers.pop(node.address):
+            server.stop()
+            if isinstance(server, HTTPServer):
+                IOLoop.current().add_callback(server.close_all_connections)
+
+
+def ring_converged(ring):
+    # every successor and predecessor pointer is the true one
+    identifiers = ring.identifiers
+    for i, identifier in enumerate(identifiers):
+        node = ring.nodes[identifier]
+        predecessor = node.predecessor
+        if node.finger[0].identifier() != identifiers[(i + 1) % len(identifiers)]:
+            return False
+        if predecessor is None or predecessor.identifier() != identifiers[i - 1]:
+            return False
+
+    return True
+
+
+def fingers_converged(ring, node):
+    return all(node.finger[i].identifier() == ring.owner(node.identifier(1 << i)).identifier()
+               for i in range(LOGSIZE))
+
+
+async def converge(condition, started):
+    # seconds from `started` until condition holds, None if it never does
+    while not condition():
+        if IOLoop.current().time() - started > CONVERGENCE_TIMEOUT:
+            return None
+
+        await gen.sleep(POLL_INTERVAL)
+
+    return IOLoop.current().time() - started
+
+
+def percentile(values, p):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else None
+
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def sent():
+    # rpcs sent so far, by command
+    return Counter({labels[0]: value for labels, value in RPC_ATTEMPTS.snapshot().items()})
+
+
+async def maintenance(ring, seconds):
+    # rpcs and cpu the daemons of a quiet ring cost, per node and second
+    nodes = len(ring.nodes)
+    rpcs = sum(sent().values())
+    cpu = time.process_time()
+    started = IOLoop.current().time()
+
+    await gen.sleep(seconds)
+
+    elapsed = IOLoop.current().time() - started
+    return {
+        'maintenance_rpcs_per_node_second': (sum(sent().values()) - rpcs) / nodes / elapsed,
+        'cpu_seconds_per_node_second': (time.process_time() - cpu) / nodes / elapsed,
+    }
+
+
+async def convergence(ring):
+    # time until the pointers are right again after one join and one failure
+    started = IOLoop.current().time()
+    node = await ring.join(ring.random.choice(list(ring.nodes.values())))
+    report = {
+        'join_convergence_seconds': await converge(lambda: ring_converged(ring), started),
+        'join_fingers_convergence_seconds': node and await converge(lambda: fingers_converged(ring, node), started),
+    }
+
+    started = IOLoop.current().time()
+    ring.kill(ring.random.choice(list(ring.nodes.values())))
+    report['failure_convergence_seconds'] = await converge(lambda: ring_converged(ring), started)
+
+    return report
+
+
+async def lookups(ring, count):
+    # one lookup at a time on a ring without daemons or cached answers, so
+    # every rpc sent belongs to the lookup
+    for node in ring.nodes.values():
+        node.lookup_cache.clear()
+
+    latencies, hops, rpcs, correct = [], [], [], 0
+    for _ in range(count):
+        node = ring.random.choice(list(ring.nodes.values()))
+        key = ring.random.randrange(SIZE)
+
+        before = sent()
+        started = IOLoop.current().time()
+        try:
+            owner = await node.find_successor(key)
+        except ChordError:
+            owner = None
+
+        latencies.append(IOLoop.current().time() - started)
+        delta = sent() - before
+        hops.append(sum(delta[command] for command in ROUTING_COMMANDS))
+        rpcs.append(sum(delta.values()))
+        correct += owner is not None and owner.identifier() == ring.owner(key).identifier()
+
+    return {
+        'lookups': count,
+        'lookup_correct': correct / count if count else None,
+        'lookup_latency_p50': percentile(latencies, 50),
+        'lookup_latency_p90': percentile(latencies, 90),
+        'lookup_latency_p99': percentile(latencies, 99),
+        'hops_per_lookup': mean(hops),
+        'rpcs_per_lookup': mean(rpcs),
+    }
+
+
+async def benchmark(ring):
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ring.build(options.sim_nodes)
+    await gen.sleep(SETTLE_TIME)
+
+    nodes = len(ring.nodes)
+    report = {
+        'nodes': nodes,
+        'logsize': LOGSIZE,
+        'transport': options.transport,
+        'lookup': options.lookup,
+        'clock': 'virtual' if options.transport == 'loopback' else 'wall',
+        # ru_maxrss is in kilobytes on linux
+        'memory_bytes_per_node': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory) * 1024 / nodes,
+    }
+
+    report.update(await maintenance(ring, options.sim_duration))
+    report.update(await convergence(ring))
+
+    await ring.stop()
+    report.update(await lookups(ring, options.sim_lookups))
+
+    return report
+
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if options.transport == 'loopback':
+        asyncio.set_event_loop(VirtualTimeLoop())
+        io_loop = VirtualTimeIOLoop(make_current=True)
+        ring = Simulator(options.sim_latency, options.sim_jitter, options.sim_seed)
+    else:
+        io_loop = IOLoop.current()
+        ring = SocketRing(options.sim_seed)
+
+    report = io_loop.run_sync(lambda: benchmark(ring))
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,57 @@
-import hashlib
+import weakref
 
-from settings import SIZE
+from core.utils import hash_key
 
 
 class Address:
-    def __init__(self, ip, port):
-        self.ip = ip
-        self.port = port
+    __slots__ = ('ip', 'port', 'identifier', '__weakref__')
 
-    def __key(self):
-        return f"{self.ip}{self.port}".encode()
+    # addresses are immutable, so equal ones can share a single instance
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, ip, port):
+        port = int(port)
+        address = cls._interned.get((ip, port))
+        if address is None:
+            address = super().__new__(cls)
+            object.__setattr__(address, 'ip', ip)
+            object.__setattr__(address, 'port', port)
+            # the ring identifier is computed once, comparisons use the cached value
+            object.__setattr__(address, 'identifier', hash_key(f"{ip}{port}"))
+            cls._interned[(ip, port)] = address
+
+        return address
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return Address, (self.ip, self.port)
 
     def __hash__(self):
         """
         Python uses a random hash seed to prevent attackers from tar-pitting your application by sending you keys
         designed to collide. to prevent changing hash code for this test project I use this method.
         """
-        m = hashlib.sha256()
-        m.update(self.__key())
-        return int(m.hexdigest(), 16) % SIZE
+        return self.identifier
 
     def __eq__(self, other):
         if isinstance(other, Address):
-            return self.__key() == other.__key()
+            return self is other or (self.ip == other.ip and self.port == other.port)
 
         return NotImplemented
 
     def __lt__(self, other):
-        return self.__hash__() < other.__hash__()
+        return self.identifier < other.identifier
 
     def __gt__(self, other):
-        return self.__hash__() > other.__hash__()
+        return self.identifier > other.identifier
 
     def __le__(self, other):
-        return self.__hash__() <= other.__hash__()
+        return self.identifier <= other.identifier
 
     def __ge__(self, other):
-        return self.__hash__() >= other.__hash__()
+        return self.identifier >= other.identifier
 
     def __str__(self):
         return f'{self.ip}:{self.port}'
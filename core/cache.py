@@ -0,0 +1,101 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from tornado.ioloop import IOLoop
+
+from core.utils import is_in_range
+from settings import SIZE
+
+
+# LRU cache of ownership intervals: an entry (start, owner] says that owner
+# is the successor of every identifier in that range. A topology change bumps
+# the version, so lookups started before it can't insert stale results.
+# Changes far away go unseen, entries past the ttl are confirmed again.
+class LookupCache:
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.version = 0
+        # owner identifier -> (start, owner, cached_at), in lru order
+        self.entries = OrderedDict()
+        # owner identifiers, sorted for bisect
+        self.owners = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, identifier):
+        if not self.owners:
+            return None
+
+        index = bisect_left(self.owners, identifier)
+        owner_id = self.owners[index % len(self.owners)]
+        entry = self.entries[owner_id]
+        start, owner, cached_at = entry
+
+        if not is_in_range(identifier, start + 1, owner_id + 1):
+            return None
+
+        self.entries.move_to_end(owner_id)
+        return entry
+
+    def expired(self, entry):
+        # older entries are kept, they only need confirming before use
+        return entry[2] + self.ttl < IOLoop.current().time()
+
+    def put(self, start, owner, version):
+        if version != self.version:
+            return
+
+        owner_id = owner.identifier()
+
+        # nodes inside (start, owner) contradict the new entry
+        for other in self.between(start + 1, owner_id):
+            self.remove(other)
+
+        # and the owner contradicts the entry whose range it falls in, a
+        # node that joined there since, that entry now starts at it
+        if self.owners:
+            after = self.owners[bisect_left(self.owners, owner_id) % len(self.owners)]
+            before, other, cached_at = self.entries[after]
+            # [before + 1, after) is empty, not the full circle, when the
+            # entry holds its owner alone
+            if (after - before - 1) % SIZE and is_in_range(owner_id, before + 1, after):
+                self.entries[after] = (owner_id, other, cached_at)
+
+        if owner_id not in self.entries:
+            insort(self.owners, owner_id)
+        self.entries[owner_id] = (start, owner, IOLoop.current().time())
+        self.entries.move_to_end(owner_id)
+
+        while len(self.entries) > self.capacity:
+            self.remove(next(iter(self.entries)))
+
+    def between(self, start, end):
+        # cached owners in [start, end) on the ring, an empty range when
+        # start == end, found by bisecting rather than by a scan
+        start, end = start % SIZE, end % SIZE
+        low, high = bisect_left(self.owners, start), bisect_left(self.owners, end)
+        if start <= end:
+            return self.owners[low:high]
+
+        return self.owners[low:] + self.owners[:high]
+
+    def remove(self, owner_id):
+        del self.entries[owner_id]
+        del self.owners[bisect_left(self.owners, owner_id)]
+
+    def discard(self, owner):
+        if owner.identifier() in self.entries:
+            self.remove(owner.identifier())
+
+    def invalidate(self, address):
+        # drop what a peer that went away was cached to own
+        entry = self.entries.get(address.identifier)
+        if entry and entry[1].address == address:
+            self.remove(address.identifier)
+
+    def clear(self):
+        self.version += 1
+        self.entries.clear()
+        self.owners = []
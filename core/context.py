@@ -0,0 +1,41 @@
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from tornado.ioloop import IOLoop
+
+from settings import REQUEST_DEADLINE
+
+# absolute deadline, on the IOLoop clock, of the request being served
+deadline = ContextVar('deadline', default=None)
+
+
+def time_left():
+    expires = deadline.get()
+
+    return None if expires is None else expires - IOLoop.current().time()
+
+
+@contextmanager
+def deadline_scope(seconds):
+    # requests carry the time they have left rather than a timestamp so
+    # nodes don't need synchronized clocks
+    token = deadline.set(None if seconds is None else IOLoop.current().time() + seconds)
+    try:
+        yield
+    finally:
+        deadline.reset(token)
+
+
+def starts_deadline(func):
+    # lookups started on this node get one deadline for all of their hops,
+    # the ones served for a peer keep the deadline it sent along
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if time_left() is not None:
+            return await func(*args, **kwargs)
+
+        with deadline_scope(REQUEST_DEADLINE):
+            return await func(*args, **kwargs)
+
+    return wrapper
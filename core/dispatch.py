@@ -0,0 +1,41 @@
+import logging
+
+from tornado.ioloop import IOLoop
+
+from core.context import deadline_scope, time_left
+from core.exceptions import ChordError, DeadlineExceeded
+from core.metrics import INBOUND_ERRORS, INBOUND_LATENCY, INBOUND_REQUESTS
+from core.tracing import server_span
+
+logger = logging.getLogger('play.' + __name__)
+
+
+async def dispatch(node, command):
+    # serve a command within the time its sender has left
+    with deadline_scope(command.get('time_left')):
+        return await serve(node, command)
+
+
+async def serve(node, command):
+    # run a command on its own or as a member of a batch, ring failures
+    # are reported back to the sender instead of failing the request
+    cmd = command['cmd']
+    started = IOLoop.current().time()
+    INBOUND_REQUESTS.inc(cmd)
+    try:
+        remaining = time_left()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f'{cmd} from {command.get("frm")} expired.')
+
+        with server_span(node, command):
+            return await node.execute_command(command)
+    except ChordError as e:
+        INBOUND_ERRORS.inc(cmd, type(e).__name__)
+        return e.to_result()
+    except Exception as e:
+        # a bug on our side, the sender gets an error instead of a timeout
+        logger.exception(f'{cmd} from {command.get("frm")} crashed')
+        INBOUND_ERRORS.inc(cmd, type(e).__name__)
+        return {'data': None, 'error': type(e).__name__, 'message': str(e)}
+    finally:
+        INBOUND_LATENCY.observe(IOLoop.current().time() - started, cmd)
@@ -1,2 +1,24 @@
-class HTTPConnection(Exception):
+class ChordError(Exception):
+    def to_result(self):
+        # the reply sent back to the peer whose command failed
+        return {'data': None, 'error': type(self).__name__, 'message': str(self)}
+
+
+class HTTPConnection(ChordError):
+    pass
+
+
+class DeadlineExceeded(ChordError):
+    pass
+
+
+class NoSuccessorAvailable(ChordError):
+    pass
+
+
+class RemoteError(ChordError):
+    pass
+
+
+class QuorumNotReached(ChordError):
     pass
@@ -0,0 +1,55 @@
+from tornado.ioloop import IOLoop
+
+from settings import SUSPECT_AFTER_FAILURES
+
+
+class PeerState:
+    __slots__ = ('last_heard', 'failures')
+
+    def __init__(self):
+        self.last_heard = None
+        self.failures = 0
+
+
+# Liveness table fed by heartbeats and by the outcome of every rpc, routing
+# reads it synchronously instead of pinging a peer before using it
+class FailureDetector:
+    def __init__(self):
+        self.peers = {}
+
+    def state(self, address):
+        state = self.peers.get(address)
+        if state is None:
+            state = self.peers[address] = PeerState()
+
+        return state
+
+    def heard_from(self, address):
+        state = self.state(address)
+        state.last_heard = IOLoop.current().time()
+        state.failures = 0
+
+    def heard_since(self, address, since):
+        # whether the peer answered since then and nothing failed after
+        state = self.peers.get(address)
+
+        return state is not None and state.failures == 0 and state.last_heard is not None and \
+            state.last_heard >= since
+
+    def failed(self, address):
+        self.state(address).failures += 1
+
+    def is_alive(self, address):
+        # peers we never talked to are given the benefit of the doubt
+        state = self.peers.get(address)
+
+        return state is None or state.failures < SUSPECT_AFTER_FAILURES
+
+    def departed(self, address):
+        # a peer that left counts as failed until it answers again, e.g.
+        # once it rejoined, lookups don't route through it meanwhile
+        state = self.state(address)
+        state.failures = max(state.failures, SUSPECT_AFTER_FAILURES)
+
+
+failure_detector = FailureDetector()
@@ -0,0 +1,86 @@
+import random
+from bisect import bisect_left
+
+from settings import LOGSIZE, SIZE
+
+
+# Finger table keeping each distinct node once, sorted by its clockwise
+# distance from the owner. Finger i is the first known node at distance
+# >= 2**i, so consecutive fingers pointing at the same node share an entry.
+class FingerTable:
+    def __init__(self, node):
+        self.node = node
+        self.distances = []
+        self.entries = []
+
+    def distance(self, identifier):
+        # the owner itself sits a full circle away
+        return (identifier - self.node.identifier() - 1) % SIZE + 1
+
+    def __len__(self):
+        return LOGSIZE
+
+    def __getitem__(self, i):
+        index = bisect_left(self.distances, 1 << i)
+
+        return self.entries[index] if index < len(self.entries) else None
+
+    def __iter__(self):
+        return (self[i] for i in range(LOGSIZE))
+
+    def __setitem__(self, i, node):
+        # node is the successor of start = n + 2**i, nothing we know of
+        # can sit in [start, node) any more
+        start = 1 << i
+        distance = self.distance(node.identifier())
+
+        low = bisect_left(self.distances, start) if distance >= start else bisect_left(self.distances, distance)
+        high = bisect_left(self.distances, distance)
+        if high < len(self.distances) and self.distances[high] == distance:
+            high += 1
+
+        self.distances[low:high] = [distance]
+        self.entries[low:high] = [node]
+
+    def seed(self, nodes):
+        # take unverified candidates, e.g. a neighbour's fingers, without
+        # dropping what we know, the next refresh confirms or replaces them
+        for node in nodes:
+            distance = self.distance(node.identifier())
+            index = bisect_left(self.distances, distance)
+            if distance < SIZE and (index == len(self.distances) or self.distances[index] != distance):
+                self.distances.insert(index, distance)
+                self.entries.insert(index, node)
+
+    def remove(self, node):
+        index = bisect_left(self.distances, self.distance(node.identifier()))
+        if index < len(self.entries) and self.entries[index].address == node.address:
+            del self.distances[index]
+            del self.entries[index]
+
+    def nodes(self):
+        return list(self.entries)
+
+    def preceding(self, identifier):
+        # known nodes strictly between us and identifier, closest to identifier first
+        index = bisect_left(self.distances, self.distance(identifier))
+
+        return self.entries[index - 1::-1] if index else []
+
+    def refresh_indices(self):
+        # one finger per distinct interval, the one with the smallest start,
+        # finger 0 is left to stabilize
+        indices = []
+        previous = 0
+        for distance in self.distances + [SIZE + 1]:
+            i = max(previous.bit_length(), 1)
+            if i < LOGSIZE and 1 << i <= distance:
+                indices.append(i)
+            previous = distance
+
+        return indices
+
+    def refresh_index(self):
+        indices = self.refresh_indices()
+
+        return random.choice(indices) if indices else None
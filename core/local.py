@@ -1,16 +1,32 @@
+import asyncio
 import logging
 import random
-import sys
+from datetime import timedelta
 
-from tornado import gen
+from tornado import gen, locks
 from tornado.ioloop import IOLoop
+from tornado.options import options
 
 from core.address import Address
+from core.cache import LookupCache
+from core.context import deadline_scope, starts_deadline
+from core.dispatch import serve
+from core.exceptions import ChordError, NoSuccessorAvailable, QuorumNotReached
+from core.failure_detector import failure_detector
+from core.finger import FingerTable
+from core.metrics import (HANDOFF_COPIES, LOOKUP_CACHE_HITS, LOOKUP_FORWARDS, LOOKUP_HOPS, MAINTENANCE_ROUNDS,
+                          READ_REPAIRS, SYNC_TRANSFERS, TOPOLOGY_CHANGES)
 from core.node import Node
-from core.remote import Remote
-from core.utils import CommandType, is_in_range, logger_decorator
-from settings import (FIX_FINGERS_INTERVAL, STABILIZE_INTERVAL, UPDATE_SUCCESSORS_INTERVAL, LOGSIZE,
-                      NUMBER_OF_SUCCESSORS)
+from core.peers import registry
+from core.remote import get_remote
+from core.singleflight import single_flight
+from core.storage import open_store
+from core.tracing import starts_trace, traced
+from core.utils import AdaptiveInterval, CommandType, first_alive, hash_key, is_in_range, quorum
+from settings import (FIX_FINGERS_INTERVAL, FIX_FINGERS_MAX_INTERVAL, STABILIZE_INTERVAL, STABILIZE_MAX_INTERVAL,
+                      INTERVAL_BACKOFF, NUMBER_OF_SUCCESSORS, PROBE_TIMEOUT, HEARTBEAT_INTERVAL, HEARTBEAT_MAX_INTERVAL,
+                      LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, SYNC_INTERVAL, SYNC_MAX_INTERVAL,
+                      TOMBSTONE_GRACE, TRANSFER_CHUNK_SIZE)
 
 
 # class representing a local peer
@@ -20,88 +36,330 @@ class Local(Node):
         # list of successors
         self.successors = []
         # initially just set successor
-        self.finger = [None for _ in range(LOGSIZE)]
+        self.finger = FingerTable(self)
         self.predecessor = None
         self.remote_address = remote_address
+        # copies of the keys this node owns or replicates
+        self.store = open_store(address)
+        # unfinished handoffs, (node, start, end) -> last identifier sent
+        self.handoffs = {}
+        # owners of recently looked up identifier ranges
+        self.lookup_cache = LookupCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL)
+        # bumped, and waiters woken, whenever ownership may have moved
+        self.topology_version = 0
+        self.topology = locks.Condition()
+        # daemons keep running until the node stops
+        self.running = False
+        # when the last monitor round started
+        self.monitored = None
 
     def start(self):
         # join the DHT
         IOLoop.current().add_callback(self.join, self.remote_address)
 
-    @logger_decorator
+    @traced
     async def join(self, remote_address=None):
         if remote_address:
-            remote = Remote(remote_address)
+            remote = get_remote(remote_address)
             self.finger[0] = await remote.find_successor(self.identifier())
+            IOLoop.current().add_callback(registry().warm_up, [self.finger[0]])
+
+            # our successor's fingers are close to ours, start from them
+            try:
+                self.finger.seed(await self.finger[0].get_fingers())
+            except ChordError as e:
+                logging.warning(f'no fingers to seed node {self.identifier()} from: {e}')
         else:
             self.finger[0] = self
 
         logging.info(f'{self.address} with id ({self.identifier()}) joined.')
 
-        # start the daemons
-        IOLoop.current().add_callback(self.stabilize)
-        IOLoop.current().add_callback(self.fix_fingers)
-        IOLoop.current().add_callback(self.update_successors)
-
-    @logger_decorator
+        self.start_daemons()
+
+    def start_daemons(self):
+        self.running = True
+        IOLoop.current().add_callback(self.run_daemon, self.stabilize,
+                                      AdaptiveInterval(STABILIZE_INTERVAL, STABILIZE_MAX_INTERVAL, INTERVAL_BACKOFF))
+        IOLoop.current().add_callback(
+            self.run_daemon, self.fix_fingers,
+            AdaptiveInterval(FIX_FINGERS_INTERVAL, FIX_FINGERS_MAX_INTERVAL, INTERVAL_BACKOFF))
+        IOLoop.current().add_callback(self.run_daemon, self.monitor,
+                                      AdaptiveInterval(HEARTBEAT_INTERVAL, HEARTBEAT_MAX_INTERVAL, INTERVAL_BACKOFF))
+        IOLoop.current().add_callback(self.run_daemon, self.sync,
+                                      AdaptiveInterval(SYNC_INTERVAL, SYNC_MAX_INTERVAL, INTERVAL_BACKOFF))
+
+    def stop(self):
+        # leave without telling anybody, like a crash would, the daemons
+        # end after their current round
+        self.running = False
+        self.topology.notify_all()
+
+    @traced
+    async def leave(self):
+        # Leave gracefully, our successor takes over our range, then both
+        # neighbours are told to link up with each other
+        successor = await self.get_successor()
+        predecessor = self.predecessor
+        self.stop()
+
+        if successor.address != self.address:
+            start = predecessor.identifier(1) if predecessor else self.identifier(1)
+            await self.hand_off(successor, start, self.identifier(1))
+
+        neighbours = {node.address: node for node in [successor, predecessor]
+                      if node and node.address != self.address}
+        await gen.multi([self.tell_leaving(node, predecessor) for node in neighbours.values()])
+
+        logging.info(f'{self.address} with id ({self.identifier()}) left.')
+
+    async def tell_leaving(self, node, predecessor):
+        try:
+            await node.leaving(self, predecessor, self.successors)
+        except ChordError as e:
+            logging.warning(f'could not tell node {node.identifier()} about leaving: {e}')
+
+    async def run_daemon(self, task, interval):
+        # Run a maintenance task until the node stops. Quiet rounds stretch the interval,
+        # a failed round or a topology change anywhere on this node brings
+        # it back to the minimum. A failed round is logged, the next one
+        # tries again.
+        while self.running:
+            version = self.topology_version
+            try:
+                changed = await task()
+                outcome = 'changed' if changed else 'quiet'
+            except ChordError as e:
+                logging.warning(f'{task.__name__} of node {self.identifier()} failed: {e}')
+                changed = True
+                outcome = 'failed'
+            except Exception:
+                # a bug must not stop the node from maintaining itself
+                logging.exception(f'{task.__name__} of node {self.identifier()} crashed')
+                changed = True
+                outcome = 'failed'
+
+            MAINTENANCE_ROUNDS.inc(task.__name__, outcome)
+            if changed or version != self.topology_version:
+                interval.reset()
+            else:
+                interval.back_off()
+
+            # sleep, unless another task notices a change in the meantime
+            await self.topology.wait(timedelta(seconds=interval.current))
+
+    @traced
     async def stabilize(self):
-        while True:
-            successor = await self.get_successor()
+        before = self.successors
+        successor = await self.get_successor()
 
-            # We may have found that x is our new successor if
-            # - x = pred(successor(n))
-            # - x exists
-            # - x is in range (n, successor(n))
-            # - [n+1, successor(n)) is non-empty
-            # fix finger[0] if successor failed
-            if successor.identifier() != self.finger[0].identifier():
-                self.finger[0] = successor
+        # fix finger[0] if successor failed
+        if successor.identifier() != self.finger[0].identifier():
+            self.finger[0] = successor
+            self.topology_changed()
 
-            predecessor = await successor.get_predecessor()
+        # One exchange notifies our successor about us and returns its
+        # predecessor x and successor list. x is our new successor if
+        # - x exists
+        # - x is in range (n, successor(n))
+        # - [n+1, successor(n)) is non-empty
+        predecessor, successors = await successor.exchange(self)
 
-            if predecessor:
-                in_range = is_in_range(predecessor.identifier(), self.identifier(1), successor.identifier())
+        if predecessor:
+            in_range = is_in_range(predecessor.identifier(), self.identifier(1), successor.identifier())
 
-                if in_range and self.identifier(1) != successor.identifier() and await predecessor.ping():
-                    self.finger[0] = predecessor
+            if in_range and self.identifier(1) != successor.identifier() and self.is_alive(predecessor):
+                self.finger[0] = predecessor
+                self.topology_changed()
 
-            # We notify our new successor about us
-            successor = await self.get_successor()
+                # our new successor doesn't know about us yet
+                predecessor, successors = await predecessor.exchange(self)
+                successor = self.finger[0]
 
-            logging.info(f'new successor is -> {successor.identifier()}')
+        logging.info('new successor is -> %s', successor.identifier())
 
-            await successor.notify(self)
-            await gen.sleep(STABILIZE_INTERVAL)
+        # if we are not alone in the ring, take over the successor list
+        if successor.identifier() != self.identifier():
+            self.successors = [successor] + successors
 
-    @logger_decorator
-    async def fix_fingers(self):
-        while True:
-            # Randomly select an entry in finger table and update its value
-            # Finger i points to successor of n+2**i
-            i = random.randrange(LOGSIZE - 1) + 1
-            self.finger[i] = await self.find_successor(self.identifier(1 << i))
+        if logging.root.isEnabledFor(logging.INFO):
+            for_print = ', '.join([f"{n.identifier()}" for n in self.successors])
+            logging.info(f'successor list for node "{self.identifier()}" is -> [{for_print}]')
 
-            for_print = ', '.join([f"{n.identifier()}" for n in self.finger if n])
-            logging.info(f'finger table for node "{self.identifier()}" is -> [{for_print}]')
+        # the ring around us is settled once our successor points back at us
+        # and the successor list stopped moving
+        settled = predecessor is not None and predecessor.address == self.address
+        return not settled or self.successors != before
 
-            await gen.sleep(FIX_FINGERS_INTERVAL)
+    @traced
+    async def fix_fingers(self):
+        # Update the whole finger table, or a random interval of it
+        # Finger i points to successor of n+2**i
+        before = self.finger.nodes()
 
-    @logger_decorator
-    async def update_successors(self):
-        while True:
-            successor = await self.get_successor()
+        if options.fingers == 'table':
+            await self.refresh_fingers()
+        else:
+            i = self.finger.refresh_index()
+            if i is not None:
+                self.finger[i] = await self.find_successor(self.identifier(1 << i), cached=False)
 
-            # if we are not alone in the ring, calculate
-            if successor.identifier() != self.identifier():
-                successor_list = await successor.get_successors()
-                self.successors = [successor] + successor_list
+        if logging.root.isEnabledFor(logging.INFO):
+            for_print = ', '.join([f"{n.identifier()}" for n in self.finger.nodes()])
+            logging.info(f'finger table for node "{self.identifier()}" is -> [{for_print}]')
 
-            for_print = ', '.join([f"{n.identifier()}" for n in self.successors])
-            logging.info(f'successor list for node "{self.identifier()}" is -> [{for_print}]')
+        return self.finger.nodes() != before
+
+    async def refresh_fingers(self):
+        # Look up one start per known interval, all in one batch. Answers
+        # can reveal new intervals further out, those get the next batch,
+        # every finger is looked up at most once per round
+        done = set()
+        indices = self.finger.refresh_indices()
+        while indices:
+            done.update(indices)
+            confirmed = await gen.multi([self.confirm_finger(i) for i in indices])
+            indices = [i for i, still in zip(indices, confirmed) if not still]
+            owners = await self.find_successors([self.identifier(1 << i) for i in indices], cached=False)
+            for i, owner in zip(indices, owners):
+                self.finger[i] = owner
+
+            indices = [i for i in self.finger.refresh_indices() if i not in done]
+
+    async def confirm_finger(self, i):
+        # A finger is still the successor of its start while its
+        # predecessor precedes that start, one message instead of a lookup
+        finger = self.finger[i]
+        if finger is None or finger.address == self.address:
+            return False
+
+        try:
+            predecessor = await finger.get_predecessor()
+        except ChordError:
+            return False
+
+        return predecessor is not None and \
+            is_in_range(self.identifier(1 << i), predecessor.identifier(1), finger.identifier(1))
+
+    @traced
+    async def monitor(self):
+        # Heartbeat our neighbours, off the lookup path, but not those that
+        # answered an rpc since the last round. Fingers are left to the
+        # lookups routed through them, a failed hop reports its finger.
+        since, self.monitored = self.monitored, IOLoop.current().time()
+
+        peers = {node.address: node for node in self.finger.nodes() + self.successors + [self.predecessor]
+                 if node and node.address != self.address}
+        neighbours = {node.address: node for node in self.successors + [self.predecessor] if node}
+        await gen.multi([self.heartbeat(node) for address, node in neighbours.items()
+                         if address != self.address and
+                         (since is None or not failure_detector.heard_since(address, since))])
+
+        # drop the peers the failure detector suspects
+        suspected = [node for node in peers.values() if not self.is_alive(node)]
+        for node in suspected:
+            self.finger.remove(node)
+
+        successors, predecessor = self.successors, self.predecessor
+        self.successors = [node for node in self.successors if self.is_alive(node)]
+        if self.predecessor and not self.is_alive(self.predecessor):
+            self.predecessor = None
+
+        if suspected:
+            # our own range only moved if a neighbour went
+            neighbours_moved = self.successors != successors or self.predecessor is not predecessor
+            self.topology_changed(None if neighbours_moved else suspected)
+
+        return bool(suspected)
+
+    @traced
+    async def sync(self):
+        # Anti-entropy for the range we own, compare our copies with the
+        # replicas holding it and trade whatever either side is missing
+        self.store.purge(IOLoop.current().time() - TOMBSTONE_GRACE)
+
+        self.prune_handoffs()
+        for node, start, end in list(self.handoffs):
+            await self.start_hand_off(node, start, end)
+
+        if not self.predecessor:
+            return False
+
+        start, end = self.predecessor.identifier(1), self.identifier(1)
+        replicas = [node for node in self.successors[:options.replicas - 1]
+                    if node.address != self.address and self.is_alive(node)]
+
+        changed = False
+        for replica in replicas:
+            try:
+                changed |= await self.sync_with(replica, start, end)
+            except ChordError as e:
+                logging.info('sync of node %s with %s failed: %s', self.identifier(), replica.identifier(), e)
+
+        return changed
+
+    async def sync_with(self, replica, start, end):
+        # walk down the hash trees where they differ, one level per round
+        # trip, so the traffic grows with the divergence, not the data
+        tree = self.store.tree
+        level, indices = 0, [0]
+        while True:
+            theirs = await replica.get_digests(start, end, level, indices)
+            ours = self.store.digests(start, end, level, indices)
+            indices = [index for index, mine, other in zip(indices, ours, theirs) if mine != other]
+            if not indices:
+                return False
+            if level == tree.depth:
+                break
+
+            level += 1
+            indices = [child for index in indices for child in tree.children(index)]
+
+        theirs = await replica.get_entries(start, end, indices)
+        ours = self.store.entries(start, end, indices)
+
+        for key, (value, version) in theirs.items():
+            if key not in ours or ours[key][1] < version:
+                self.store.put(key, value, version)
+                SYNC_TRANSFERS.inc('pull')
+
+        push = [(key, value, version) for key, (value, version) in ours.items()
+                if key not in theirs or theirs[key][1] < version]
+        SYNC_TRANSFERS.inc('push', amount=len(push))
+        await gen.multi([replica.replica_put(key, value, version) for key, value, version in push])
 
-            await gen.sleep(UPDATE_SUCCESSORS_INTERVAL)
+        return True
 
-    @logger_decorator
+    async def heartbeat(self, remote):
+        try:
+            await asyncio.wait_for(remote.ping(), PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            failure_detector.failed(remote.address)
+
+    def topology_changed(self, gone=None):
+        # ownership of some identifier ranges may have moved. When all
+        # that happened is that `gone` peers away from us left, only the
+        # ranges they owned did, to their successors.
+        if gone is None:
+            self.lookup_cache.clear()
+        else:
+            for node in gone:
+                self.lookup_cache.invalidate(node.address)
+        self.prune_handoffs()
+        self.topology_version += 1
+        TOPOLOGY_CHANGES.inc()
+        self.topology.notify_all()
+
+    def prune_handoffs(self, gone=()):
+        # handoffs to nodes that left, or that the failure detector gave
+        # up on, have nobody to resume with
+        for handoff in list(self.handoffs):
+            if handoff[0].address in gone or not self.is_alive(handoff[0]):
+                del self.handoffs[handoff]
+
+    def is_alive(self, node):
+        return node.address == self.address or failure_detector.is_alive(node.address)
+
+    @traced
     async def execute_command(self, command):
         cmd = command['cmd']
         data = command.get('data')
@@ -117,29 +375,90 @@ class Local(Node):
                 result['data'] = {'ip': self.predecessor.address.ip, 'port': self.predecessor.address.port}
 
         elif cmd == CommandType.FIND_SUCCESSOR:
-            successor = await self.find_successor(data['identifier'])
+            successor = await self.find_successor(data['identifier'], data.get('recursive'), data.get('cached', True))
             result['data'] = {'ip': successor.address.ip, 'port': successor.address.port}
 
+        elif cmd == CommandType.FIND_SUCCESSORS_BATCH:
+            successors = await self.find_successors(data['identifiers'], data.get('cached', True))
+            result['data'] = [{'ip': node.address.ip, 'port': node.address.port} for node in successors]
+
         elif cmd == CommandType.CLOSEST_PRECEDING_FINGER:
             closest = await self.get_closest_preceding_finger(data['identifier'])
             result['data'] = {'ip': closest.address.ip, 'port': closest.address.port}
 
         elif cmd == CommandType.NOTIFY:
-            await self.notify(Remote(Address(data['ip'], data['port'])))
+            await self.notify(get_remote(Address(data['ip'], data['port'])))
+
+        elif cmd == CommandType.SUGGEST_SUCCESSOR:
+            await self.suggest_successor(get_remote(Address(data['ip'], data['port'])))
+
+        elif cmd == CommandType.STABILIZE:
+            predecessor, successors = await self.exchange(get_remote(Address(data['ip'], data['port'])))
+            result['data'] = {
+                'predecessor': ({'ip': predecessor.address.ip, 'port': predecessor.address.port}
+                                if predecessor else None),
+                'successors': [{'ip': node.address.ip, 'port': node.address.port} for node in successors],
+            }
 
         elif cmd == CommandType.GET_SUCCESSORS:
             result['data'] = await self.get_successors()
 
+        elif cmd == CommandType.GET_FINGERS:
+            fingers = await self.get_fingers()
+            result['data'] = [{'ip': node.address.ip, 'port': node.address.port} for node in fingers]
+
         elif cmd == CommandType.PING:
             result['data'] = True
 
+        elif cmd == CommandType.BATCH:
+            result['data'] = await self.execute_batch(data['commands'], data.get('concurrent', False))
+
+        elif cmd == CommandType.PUT:
+            result['data'] = await self.put(data['key'], data['value'], data.get('owner', False))
+
+        elif cmd == CommandType.GET:
+            result['data'] = await self.get(data['key'], data.get('owner', False))
+
+        elif cmd == CommandType.DELETE:
+            result['data'] = await self.delete(data['key'], data.get('owner', False))
+
+        elif cmd == CommandType.REPLICA_PUT:
+            result['data'] = await self.replica_put(data['key'], data['value'], tuple(data['version']))
+
+        elif cmd == CommandType.REPLICA_GET:
+            result['data'] = await self.replica_get(data['key'])
+
+        elif cmd == CommandType.SYNC_DIGESTS:
+            result['data'] = await self.get_digests(data['start'], data['end'], data['level'], data['indices'])
+
+        elif cmd == CommandType.TRANSFER:
+            result['data'] = await self.transfer(data['entries'])
+
+        elif cmd == CommandType.LEAVE:
+            predecessor = data['predecessor']
+            await self.leaving(get_remote(Address(data['ip'], data['port'])),
+                               get_remote(Address(predecessor['ip'], predecessor['port'])) if predecessor else None,
+                               [get_remote(Address(node['ip'], node['port'])) for node in data['successors']])
+
+        elif cmd == CommandType.SYNC_ENTRIES:
+            entries = await self.get_entries(data['start'], data['end'], data['leaves'])
+            result['data'] = [[key, value, version] for key, (value, version) in entries.items()]
+
         return result
 
-    @logger_decorator
+    async def execute_batch(self, commands, concurrent=False):
+        # run the sub-commands in order, or all at once when they are
+        # independent, failures are reported per sub-command
+        if concurrent:
+            return await gen.multi([serve(self, command) for command in commands])
+
+        return [await serve(self, command) for command in commands]
+
+    @traced
     async def ping(self):
         return True
 
-    @logger_decorator
+    @traced
     async def notify(self, remote):
         # Someone thinks they are our predecessor, they are if
         # - we don't have a predecessor
@@ -150,40 +469,164 @@ class Local(Node):
 
         if not await self.get_predecessor():
             self.predecessor = remote
+            self.topology_changed()
         else:
             predecessor = await self.get_predecessor()
             in_range = is_in_range(remote.identifier(), predecessor.identifier(1), self.identifier())
 
-            if in_range:
+            # (pred(n), n) is empty, not the full circle, when pred(n) = n - 1
+            if in_range and predecessor.identifier(1) != self.identifier():
                 self.predecessor = remote
-
-    @logger_decorator
+                self.topology_changed()
+
+                # the newcomer owns (pred(n), remote] now, hand it over
+                if remote.address != self.address:
+                    IOLoop.current().add_callback(self.start_hand_off, remote, predecessor.identifier(1),
+                                                  remote.identifier(1))
+
+                # our previous predecessor may be stabilizing slowly, point
+                # it at the newcomer instead of waiting for its next round
+                if predecessor.address not in (self.address, remote.address):
+                    IOLoop.current().add_callback(self.hint_successor, predecessor, remote)
+
+    @traced
+    async def leaving(self, node, predecessor, successors):
+        # `node` leaves the ring, take its predecessor or successors over
+        # where it was ours, without waiting for the failure detector
+        changed = False
+        if self.predecessor and self.predecessor.address == node.address:
+            self.predecessor = predecessor if predecessor and predecessor.address != self.address else None
+            changed = True
+
+        addresses = [remote.address for remote in self.successors]
+        if node.address in addresses or (self.finger[0] and self.finger[0].address == node.address):
+            kept = self.successors[:addresses.index(node.address)] if node.address in addresses else []
+            merged = {}
+            for remote in kept + successors:
+                if remote.address not in (node.address, self.address):
+                    merged.setdefault(remote.address, remote)
+
+            self.successors = list(merged.values())[:NUMBER_OF_SUCCESSORS]
+            self.finger.remove(node)
+            self.finger[0] = self.successors[0] if self.successors else self
+            changed = True
+        else:
+            self.finger.remove(node)
+
+        # it is out of our tables, and stays suspected should stale
+        # entries of other peers still point at it
+        failure_detector.departed(node.address)
+        self.prune_handoffs([node.address])
+
+        self.topology_changed(None if changed else [node])
+
+    async def start_hand_off(self, node, start, end):
+        try:
+            await self.hand_off(node, start, end)
+        except ChordError as e:
+            logging.warning(f'handoff to node {node.identifier()} stopped, it resumes later: {e}')
+
+    @single_flight
+    async def hand_off(self, node, start, end):
+        # Stream our copies in [start, end) to `node` in chunks, the next
+        # chunk is only built once the last one was acknowledged. Progress
+        # is kept so a handoff that fails resumes where it stopped.
+        handoff = (node, start, end)
+        after = self.handoffs.setdefault(handoff, None)
+
+        chunk = []
+        for identifier in self.store.tree.walk(start, end, after):
+            chunk.extend([key, value, version] for key, (value, version) in self.store.copies(identifier).items())
+            if len(chunk) >= TRANSFER_CHUNK_SIZE:
+                await node.transfer(chunk)
+                HANDOFF_COPIES.inc(amount=len(chunk))
+                self.handoffs[handoff] = identifier
+                chunk = []
+
+                # leave room for lookups between chunks
+                await gen.sleep(0)
+
+        if chunk:
+            await node.transfer(chunk)
+            HANDOFF_COPIES.inc(amount=len(chunk))
+
+        self.handoffs.pop(handoff, None)
+
+    @traced
+    async def transfer(self, entries):
+        for key, value, version in entries:
+            self.store.put(key, value, tuple(version))
+        # the sender moves on to the next chunk once we acknowledge this one
+        await self.store.durable()
+
+        return len(entries)
+
+    async def hint_successor(self, remote, node):
+        try:
+            await remote.suggest_successor(node)
+        except ChordError as e:
+            logging.warning(f'successor hint to node {remote.identifier()} failed: {e}')
+
+    @traced
+    async def suggest_successor(self, node):
+        # Someone thinks `node` sits between us and our successor, check it
+        # like stabilize would and wake the daemons to notify it right away
+        successor = next((node for node in [self.finger[0]] + self.successors if node), None)
+        if successor is None:
+            # we haven't joined yet, there is no successor to replace
+            return
+
+        in_range = is_in_range(node.identifier(), self.identifier(1), successor.identifier())
+
+        if in_range and self.identifier(1) != successor.identifier() and self.is_alive(node):
+            self.finger[0] = node
+            self.topology_changed()
+
+    @traced
+    async def exchange(self, remote):
+        # `remote` thinks it precedes us, answer with what it needs to
+        # stabilize: our predecessor and our successor list
+        await self.notify(remote)
+
+        return self.predecessor, self.successors[:NUMBER_OF_SUCCESSORS - 1]
+
+    @traced
     async def get_successors(self):
         s = [{'ip': node.address.ip, 'port': node.address.port} for node in self.successors[:NUMBER_OF_SUCCESSORS - 1]]
 
         return s
 
-    @logger_decorator
+    @traced
+    async def get_fingers(self):
+        return [node for node in self.finger.nodes() if self.is_alive(node)]
+
+    @traced
     async def get_successor(self):
         # We make sure to return an existing successor, there `might`
         # be redundancy between finger[0] and successors[0], but
         # it doesn't harm
-        for remote in [self.finger[0]] + self.successors:
-            connected = await remote.ping()
+        candidates = [node for node in [self.finger[0]] + self.successors if node]
 
-            if connected:
+        # trust the failure detector, only probe when it suspects everyone
+        remote = next((node for node in candidates if self.is_alive(node)), None) or await self.probe(candidates)
+        if remote:
+            if remote is not self.finger[0]:
                 self.finger[0] = remote
-                return remote
+                self.topology_changed()
+
+            return remote
 
-        print("No successor available, aborting")
-        sys.exit(-1)
+        raise NoSuccessorAvailable(f'No successor of node {self.identifier()} is alive.')
 
-    @logger_decorator
+    @traced
     async def get_predecessor(self):
         return self.predecessor
 
-    @logger_decorator
-    async def find_successor(self, identifier):
+    @traced
+    @starts_deadline
+    @single_flight
+    @starts_trace
+    async def find_successor(self, identifier, recursive=None, cached=True):
         # The successor of a key can be us if
         # - we have a pred(n)
         # - identifier is in (pred(n), n]
@@ -191,32 +634,296 @@ class Local(Node):
         if predecessor and is_in_range(identifier, predecessor.identifier(1), self.identifier(1)):
             return self
 
-        node = await self.find_predecessor(identifier)
-
-        return await node.get_successor()
-
-    @logger_decorator
+        # steady state lookups are answered from the cache. Finger upkeep
+        # skips the caches on every hop, it is how nodes joining far away
+        # are found.
+        owner = await self.cached_successor(identifier) if cached else None
+        if owner:
+            LOOKUP_CACHE_HITS.inc()
+            return owner
+
+        if recursive is None:
+            recursive = options.lookup == 'recursive'
+
+        version = self.lookup_cache.version
+        if recursive:
+            owner = await self.forward_find_successor(identifier, cached)
+            start = identifier - 1
+        else:
+            node = await self.find_predecessor(identifier)
+            owner = await node.get_successor()
+            # the whole (node, owner] range is owned, unless routing gave up early
+            in_range = is_in_range(identifier, node.identifier(1), owner.identifier(1))
+            start = node.identifier() if in_range else identifier - 1
+
+        if owner.address != self.address:
+            self.lookup_cache.put(start, owner, version)
+
+        return owner
+
+    @traced
+    @starts_deadline
+    @starts_trace
+    async def find_successors(self, identifiers, cached=True):
+        # Resolve many identifiers at once: answer what we can locally and
+        # forward the rest in one sub-batch per next hop
+        predecessor = await self.get_predecessor()
+        successor = await self.get_successor()
+        version = self.lookup_cache.version
+
+        owners = {}
+        hops = {}
+        for identifier in sorted(set(identifiers)):
+            owner = self.fresh_successor(identifier) if cached else None
+
+            if predecessor and is_in_range(identifier, predecessor.identifier(1), self.identifier(1)):
+                owners[identifier] = self
+            elif owner:
+                owners[identifier] = owner
+            elif is_in_range(identifier, self.identifier(1), successor.identifier(1)):
+                owners[identifier] = successor
+            else:
+                node = self.closest_preceding_node(identifier)
+                if node.address == self.address:
+                    owners[identifier] = successor
+                else:
+                    hops.setdefault(node.address, (node, []))[1].append(identifier)
+
+        batches = list(hops.values())
+        results = await gen.multi([node.find_successors(batch, cached) for node, batch in batches])
+        for (_, batch), found in zip(batches, results):
+            for identifier, owner in zip(batch, found):
+                owners[identifier] = owner
+                self.lookup_cache.put(identifier - 1, owner, version)
+
+        return [owners[identifier] for identifier in identifiers]
+
+    def fresh_successor(self, identifier):
+        # A cached owner is trusted without asking anybody while it is
+        # alive and within the ttl: topology changes we see clear the
+        # cache and owners that fail are dropped from it
+        entry = self.lookup_cache.get(identifier)
+        if entry is None or self.lookup_cache.expired(entry) or not self.is_alive(entry[1]):
+            return None
+
+        return entry[1]
+
+    async def cached_successor(self, identifier):
+        entry = self.lookup_cache.get(identifier)
+        if entry is None or not self.is_alive(entry[1]):
+            return None
+        if not self.lookup_cache.expired(entry):
+            return entry[1]
+
+        # A node may have joined next to an owner far away since, none of
+        # our tables tells, its predecessor confirms the entry at the cost
+        # of one hop
+        owner = entry[1]
+        version = self.lookup_cache.version
+        try:
+            predecessor = await owner.get_predecessor()
+        except ChordError:
+            return None
+
+        if predecessor and is_in_range(identifier, predecessor.identifier(1), owner.identifier(1)):
+            self.lookup_cache.put(predecessor.identifier(), owner, version)
+            return owner
+
+        self.lookup_cache.discard(owner)
+        return None
+
+    @traced
+    async def forward_find_successor(self, identifier, cached=True):
+        # answer if the key falls between us and our successor, otherwise
+        # hand the whole lookup over to the closest node we know of
+        successor = await self.get_successor()
+        if is_in_range(identifier, self.identifier(1), successor.identifier(1)):
+            return successor
+
+        node = await self.get_closest_preceding_finger(identifier)
+        if node.address == self.address:
+            return successor
+
+        LOOKUP_FORWARDS.inc()
+        return await node.find_successor(identifier, recursive=True, cached=cached)
+
+    @traced
     async def find_predecessor(self, identifier):
         node = self
+        hops = 0
 
         # If we are alone in the ring, we are the pred(identifier)
         successor = await node.get_successor()
         if successor.identifier() == node.identifier():
             return node
 
-        successor = await node.get_successor()
         while not is_in_range(identifier, node.identifier(1), successor.identifier(1)):
+            closest = await node.get_closest_preceding_finger(identifier)
+            hops += 1
+
+            # nobody closer is known, settle for the current node
+            if closest.address == node.address:
+                break
+
+            node = closest
             successor = await node.get_successor()
-            node = await node.get_closest_preceding_finger(identifier)
 
+        LOOKUP_HOPS.observe(hops)
         return node
 
-    @logger_decorator
+    @traced
     async def get_closest_preceding_finger(self, identifier):
+        return self.closest_preceding_node(identifier)
+
+    def closest_preceding_node(self, identifier):
         # first fingers in decreasing distance, then successors in
         # increasing distance.
-        for remote in reversed(self.successors + self.finger):
-            if remote and is_in_range(remote.identifier(), self.identifier(1), identifier) and await remote.ping():
+        successors = [remote for remote in reversed(self.successors)
+                      if is_in_range(remote.identifier(), self.identifier(1), identifier)]
+
+        candidates = self.finger.preceding(identifier) + successors
+
+        return next((remote for remote in candidates if self.is_alive(remote)), self)
+
+    @traced
+    async def probe(self, candidates):
+        # return the first live candidate, either pinging them all at
+        # once or one after the other
+        if options.probe == 'concurrent':
+            return await first_alive(candidates, PROBE_TIMEOUT)
+
+        for remote in candidates:
+            if await remote.ping():
                 return remote
 
-        return self
+        return None
+
+    @traced
+    async def route(self, key, owner=False):
+        # Where a key operation goes next, None once it reached the node
+        # owning the key. Every hop is strictly closer to the key, and the
+        # hop before the owner tells it that it owns the key, so nodes that
+        # disagree about ownership can't send an operation back and forth.
+        identifier = hash_key(key)
+        predecessor = self.predecessor
+        if predecessor and is_in_range(identifier, predecessor.identifier(1), self.identifier(1)):
+            return None, False
+
+        if owner:
+            # a node joined in front of us since the sender last stabilized
+            if predecessor and predecessor.address != self.address and self.is_alive(predecessor):
+                return predecessor, True
+
+            return None, False
+
+        successor = await self.get_successor()
+        if successor.address == self.address:
+            return None, False
+
+        if is_in_range(identifier, self.identifier(1), successor.identifier(1)):
+            return successor, True
+
+        node = self.closest_preceding_node(identifier)
+        if node.address == self.address:
+            return successor, True
+
+        LOOKUP_FORWARDS.inc()
+        return node, False
+
+    def replicas(self):
+        # the owner of a key, us, followed by the successors after it
+        replicas = {self.address: self}
+        for node in self.successors:
+            replicas.setdefault(node.address, node)
+
+        return list(replicas.values())[:options.replicas]
+
+    def new_version(self):
+        # last writer wins, ties broken by the coordinator, so clocks of
+        # the coordinating nodes should be roughly in sync
+        return IOLoop.current().time(), self.identifier()
+
+    @traced
+    async def write(self, key, value, version):
+        # every replica is sent the write, it is done once a write quorum
+        # acknowledged it, the rest catch up in the background
+        replicas = self.replicas()
+        needed = min(options.write_quorum, len(replicas))
+
+        acks = await quorum(lambda replica: replica.replica_put(key, value, version), replicas, needed,
+                            width=len(replicas))
+        if len(acks) < needed:
+            raise QuorumNotReached(f'{len(acks)} of {needed} replicas of key {key} acknowledged the write.')
+
+        return [existed for _, existed in acks]
+
+    @traced
+    async def put(self, key, value, owner=False):
+        node, last = await self.route(key, owner)
+        if node:
+            return await node.put(key, value, last)
+
+        await self.write(key, value, self.new_version())
+
+        return True
+
+    @traced
+    async def get(self, key, owner=False):
+        node, last = await self.route(key, owner)
+        if node:
+            return await node.get(key, last)
+
+        # a read quorum of replicas picked at random, so hot keys spread
+        # over all their replicas, the newest copy wins
+        replicas = self.replicas()
+        needed = min(options.read_quorum, len(replicas))
+
+        answers = await quorum(lambda replica: replica.replica_get(key), random.sample(replicas, len(replicas)),
+                               needed)
+        if len(answers) < needed:
+            raise QuorumNotReached(f'{len(answers)} of {needed} replicas of key {key} answered the read.')
+
+        value, version = max((answer for _, answer in answers), key=lambda answer: answer[1] or ())
+        stale = [replica for replica, (_, seen) in answers if seen != version]
+        if version and stale:
+            IOLoop.current().add_callback(self.read_repair, key, value, version, stale)
+
+        return value
+
+    @traced
+    async def delete(self, key, owner=False):
+        node, last = await self.route(key, owner)
+        if node:
+            return await node.delete(key, last)
+
+        # deleting writes a tombstone, tell whether the key was there
+        return any(await self.write(key, None, self.new_version()))
+
+    async def read_repair(self, key, value, version, replicas):
+        # the read is answered already, the repair gets a deadline of its own
+        READ_REPAIRS.inc(amount=len(replicas))
+        with deadline_scope(None):
+            try:
+                await gen.multi([replica.replica_put(key, value, version) for replica in replicas])
+            except ChordError as e:
+                logging.info('read repair of key %s failed: %s', key, e)
+
+    @traced
+    async def replica_put(self, key, value, version):
+        existed = self.store.put(key, value, version)
+        # acknowledged copies must survive a crash
+        await self.store.durable()
+
+        return existed
+
+    @traced
+    async def replica_get(self, key):
+        return self.store.get_version(key)
+
+    @traced
+    async def get_digests(self, start, end, level, indices):
+        return self.store.digests(start, end, level, indices)
+
+    @traced
+    async def get_entries(self, start, end, leaves):
+        return self.store.entries(start, end, leaves)
@@ -0,0 +1,151 @@
+from bisect import bisect_left
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# upper bounds of the lookup hop buckets
+HOP_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 12, 16, 20, 24, 32)
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+# A metric family, one sample per combination of label values. Updates
+# are a dict lookup and an addition, everything runs on the event loop
+# so there is nothing to lock, the text format is only built on scrape.
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.children = {}
+
+    def label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        for values, value in sorted(self.children.items()):
+            yield f'{self.name}{self.label_text(values)} {value}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+
+        return '\n'.join(lines)
+
+    def snapshot(self):
+        return dict(self.children)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *values, amount=1):
+        self.children[values] = self.children.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *values):
+        self.children[values] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *values):
+        # per bucket counts (the last one is +Inf) and the running sum
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = [[0] * (len(self.buckets) + 1), 0]
+
+        child[0][bisect_left(self.buckets, value)] += 1
+        child[1] += value
+
+    def samples(self):
+        for values, (counts, total) in sorted(self.children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{self.label_text(values, [("le", bound)])} {cumulative}'
+
+            yield f'{self.name}_sum{self.label_text(values)} {total}'
+            yield f'{self.name}_count{self.label_text(values)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        # prometheus text exposition format
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+registry = Registry()
+
+# rpcs served, whatever transport they came in on, each member of a batch
+# counts on its own as well as the batch
+INBOUND_REQUESTS = registry.counter('chord_inbound_requests_total', 'Commands received from peers.', ('command',))
+INBOUND_ERRORS = registry.counter('chord_inbound_errors_total', 'Commands that failed on this node.',
+                                  ('command', 'error'))
+INBOUND_LATENCY = registry.histogram('chord_inbound_latency_seconds', 'Time spent serving a command.', ('command',))
+
+# rpcs sent, a command coalesced into a batch counts on its own
+OUTBOUND_REQUESTS = registry.counter('chord_outbound_requests_total', 'Commands sent to peers.', ('command',))
+OUTBOUND_ERRORS = registry.counter('chord_outbound_errors_total', 'Commands sent that failed.', ('command', 'error'))
+OUTBOUND_LATENCY = registry.histogram('chord_outbound_latency_seconds', 'Time until a peer answered a command.',
+                                      ('command',))
+RPC_ATTEMPTS = registry.counter('chord_rpc_attempts_total', 'Requests put on the wire, retries included.',
+                                ('command',))
+RPC_RETRIES = registry.counter('chord_rpc_retries_total', 'Requests retried after a failed attempt.', ('command',))
+
+# routing
+LOOKUP_HOPS = registry.histogram('chord_lookup_hops', 'Nodes asked for a closer finger by an iterative lookup.',
+                                 buckets=HOP_BUCKETS)
+LOOKUP_FORWARDS = registry.counter('chord_lookup_forwards_total', 'Recursive lookups handed over to another node.')
+LOOKUP_CACHE_HITS = registry.counter('chord_lookup_cache_hits_total', 'Lookups answered from the lookup cache.')
+
+# storage
+READ_REPAIRS = registry.counter('chord_read_repairs_total', 'Stale replicas sent the newest copy after a read.')
+HANDOFF_COPIES = registry.counter('chord_handoff_copies_total', 'Copies handed over to a node taking over a range.')
+SYNC_TRANSFERS = registry.counter('chord_sync_transfers_total', 'Copies anti-entropy sent to or took from a replica.',
+                                  ('direction',))
+
+# maintenance
+MAINTENANCE_ROUNDS = registry.counter('chord_maintenance_rounds_total', 'Rounds of the maintenance daemons.',
+                                      ('task', 'outcome'))
+TOPOLOGY_CHANGES = registry.counter('chord_topology_changes_total',
+                                    'Successor or predecessor changes and peers dropped as dead.')
+
+# state of the node, set on scrape
+FINGERS = registry.gauge('chord_fingers', 'Distinct nodes in the finger table.')
+SUCCESSORS = registry.gauge('chord_successors', 'Length of the successor list.')
+PREDECESSOR_KNOWN = registry.gauge('chord_predecessor_known', 'Whether the node knows its predecessor.')
+LOOKUP_CACHE_ENTRIES = registry.gauge('chord_lookup_cache_entries', 'Ownership intervals in the lookup cache.')
@@ -1,3 +1,4 @@
+from core.singleflight import SingleFlight
 from settings import SIZE
 
 
@@ -5,6 +6,8 @@ class Node:
     def __init__(self, address, remote_address=None):
         self.address = address
         self.remote_address = remote_address
+        # calls to this node currently in flight, shared by concurrent callers
+        self.in_flight = SingleFlight()
 
     async def get_successors(self):
         raise NotImplementedError
@@ -15,7 +18,10 @@ class Node:
     async def get_predecessor(self):
         raise NotImplementedError
 
-    async def find_successor(self, identifier):
+    async def find_successor(self, identifier, recursive=None, cached=True):
+        raise NotImplementedError
+
+    async def find_successors(self, identifiers, cached=True):
         raise NotImplementedError
 
     async def get_closest_preceding_finger(self, identifier):
@@ -27,8 +33,47 @@ class Node:
     async def notify(self, node):
         raise NotImplementedError
 
+    async def exchange(self, node):
+        raise NotImplementedError
+
+    async def suggest_successor(self, node):
+        raise NotImplementedError
+
+    async def get_fingers(self):
+        raise NotImplementedError
+
+    async def put(self, key, value, owner=False):
+        raise NotImplementedError
+
+    async def get(self, key, owner=False):
+        raise NotImplementedError
+
+    async def delete(self, key, owner=False):
+        raise NotImplementedError
+
+    async def replica_put(self, key, value, version):
+        raise NotImplementedError
+
+    async def replica_get(self, key):
+        raise NotImplementedError
+
+    async def get_digests(self, start, end, level, indices):
+        raise NotImplementedError
+
+    async def get_entries(self, start, end, leaves):
+        raise NotImplementedError
+
+    async def transfer(self, entries):
+        raise NotImplementedError
+
+    async def leaving(self, node, predecessor, successors):
+        raise NotImplementedError
+
     def identifier(self, offset=0):
-        return (self.address.__hash__() + offset) % SIZE
+        if not offset:
+            return self.address.identifier
+
+        return (self.address.identifier + offset) % SIZE
 
     def __str__(self):
         return f"{self.address}"
@@ -0,0 +1,151 @@
+import asyncio
+
+from tornado import locks
+from tornado.httpclient import HTTPClientError
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.options import options
+
+from core.exceptions import HTTPConnection
+from core.stream import KeepAliveConnection, StreamConnection
+from settings import MAX_CONNECTIONS_PER_PEER, PEER_IDLE_TIMEOUT
+
+
+# connections to a single peer, bounded by MAX_CONNECTIONS_PER_PEER
+class PeerPool:
+    def __init__(self, address):
+        self.address = address
+        # framed tcp connections, shared by concurrent requests
+        self.connections = []
+        self.connecting = None
+        # http connections not carrying a request, the last one used on top
+        self.idle = []
+        self.semaphore = locks.Semaphore(MAX_CONNECTIONS_PER_PEER)
+        self.last_used = IOLoop.current().time()
+
+    async def connect(self):
+        try:
+            connection = await StreamConnection.connect(self.address)
+            self.connections.append(connection)
+
+            return connection
+        finally:
+            self.connecting = None
+
+    async def connection(self):
+        self.last_used = IOLoop.current().time()
+        self.connections = [connection for connection in self.connections if not connection.closed()]
+
+        # prefer an idle connection, open a new one while under the limit
+        connection = min(self.connections, key=lambda c: len(c.pending), default=None)
+        if connection and (not connection.pending or len(self.connections) >= MAX_CONNECTIONS_PER_PEER):
+            return connection
+
+        if self.connecting is None:
+            self.connecting = asyncio.ensure_future(self.connect())
+            # a failed connect is reported to whoever awaits it, don't warn about it
+            self.connecting.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+        return connection or await self.connecting
+
+    async def request(self, msg):
+        connection = await self.connection()
+
+        return await connection.request(msg)
+
+    async def fetch(self, path, body):
+        async with self.semaphore:
+            self.last_used = IOLoop.current().time()
+
+            while self.idle:
+                connection = self.idle.pop()
+                if connection.closed():
+                    continue
+
+                try:
+                    return await self.send(connection, path, body)
+                except HTTPConnection:
+                    # the peer may have closed the connection while it was idle
+                    continue
+
+            return await self.send(await KeepAliveConnection.connect(self.address), path, body)
+
+    async def send(self, connection, path, body):
+        # the connection goes back to the idle ones once its response was
+        # read in full, an error status included, it is closed otherwise
+        try:
+            return await connection.request(path, body)
+        except HTTPClientError:
+            raise
+        except BaseException:
+            connection.stream.close()
+            raise
+        finally:
+            self.release(connection)
+
+    def release(self, connection):
+        if not connection.closed():
+            self.idle.append(connection)
+
+    async def warm_up(self):
+        # open a connection for the requests to come
+        if options.transport == 'tcp':
+            await self.connection()
+        elif options.transport == 'http' and not self.idle:
+            async with self.semaphore:
+                self.release(await KeepAliveConnection.connect(self.address))
+
+    def close(self):
+        for connection in self.connections + self.idle:
+            connection.stream.close()
+
+        self.connections = []
+        self.idle = []
+
+
+# interned remotes and their connection pools, one registry per event loop
+class PeerRegistry:
+    def __init__(self):
+        self.remotes = {}
+        self.pools = {}
+        self.reaper = PeriodicCallback(self.close_idle, PEER_IDLE_TIMEOUT * 1000 / 2)
+        self.reaper.start()
+
+    def get_remote(self, address, factory):
+        remote = self.remotes.get(address)
+        if remote is None:
+            remote = self.remotes[address] = factory(address)
+
+        return remote
+
+    def pool(self, address):
+        pool = self.pools.get(address)
+        if pool is None:
+            pool = self.pools[address] = PeerPool(address)
+
+        return pool
+
+    async def warm_up(self, remotes):
+        # open connections ahead of the first stabilize round
+        await asyncio.gather(*[self.pool(remote.address).warm_up() for remote in remotes], return_exceptions=True)
+
+    def close_idle(self):
+        deadline = IOLoop.current().time() - PEER_IDLE_TIMEOUT
+        for address, pool in list(self.pools.items()):
+            if pool.last_used < deadline:
+                pool.close()
+                del self.pools[address]
+
+
+_registries = {}
+
+
+def registry():
+    loop = IOLoop.current()
+    if loop not in _registries:
+        # registries of loops closed since go away with them
+        for closed in [other for other in _registries if other.asyncio_loop.is_closed()]:
+            _registries.pop(closed).reaper.stop()
+
+        _registries[loop] = PeerRegistry()
+
+    return _registries[loop]
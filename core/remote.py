@@ -1,96 +1,343 @@
-import json
-import sys
+import asyncio
+import random
+from collections import namedtuple
 
 from tornado import gen
-from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPClientError
+from tornado.ioloop import IOLoop
 from tornado.options import options
 
 from core.address import Address
-from core.exceptions import HTTPConnection
+from core.context import deadline_scope, time_left
+from core.exceptions import ChordError, DeadlineExceeded, HTTPConnection, RemoteError
+from core.failure_detector import failure_detector
+from core.metrics import OUTBOUND_ERRORS, OUTBOUND_LATENCY, OUTBOUND_REQUESTS, RPC_ATTEMPTS, RPC_RETRIES
 from core.node import Node
-from core.utils import CommandType, logger_decorator
+from core.peers import registry
+from core.singleflight import single_flight
+from core.tracing import client_span, traced
+from core.transport import transport
+from core.utils import CommandType
+from settings import PROBE_TIMEOUT, REQUEST_DEADLINE, RPC_TIMEOUT
+
+
+class RetryPolicy(namedtuple('RetryPolicy', ['attempts', 'timeout', 'backoff', 'max_backoff'])):
+    def backoff_delay(self, attempt):
+        # full jitter keeps retrying peers from hammering a node in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy(attempts=2, timeout=RPC_TIMEOUT, backoff=0.1, max_backoff=1)
+
+RETRY_POLICIES = {
+    # liveness checks must fail fast, the failure detector does the rest
+    CommandType.PING: RetryPolicy(attempts=1, timeout=PROBE_TIMEOUT, backoff=0, max_backoff=0),
+    CommandType.PUT: RetryPolicy(attempts=3, timeout=RPC_TIMEOUT, backoff=0.1, max_backoff=1),
+    CommandType.GET: RetryPolicy(attempts=3, timeout=RPC_TIMEOUT, backoff=0.1, max_backoff=1),
+    CommandType.DELETE: RetryPolicy(attempts=3, timeout=RPC_TIMEOUT, backoff=0.1, max_backoff=1),
+    # replicas keep the newest version, writing one twice is harmless
+    CommandType.REPLICA_PUT: RetryPolicy(attempts=3, timeout=RPC_TIMEOUT, backoff=0.1, max_backoff=1),
+    CommandType.REPLICA_GET: RetryPolicy(attempts=3, timeout=RPC_TIMEOUT, backoff=0.1, max_backoff=1),
+    CommandType.TRANSFER: RetryPolicy(attempts=3, timeout=RPC_TIMEOUT, backoff=0.1, max_backoff=1),
+}
+
+
+# failures a peer reports that mean the same thing on this side
+ERRORS = {error.__name__: error for error in (DeadlineExceeded, HTTPConnection)}
+
+# liveness checks keep their own short timeout, batches can't nest, and
+# commands routed on through the ring would hold back a whole batch
+UNBATCHED_COMMANDS = (CommandType.PING, CommandType.BATCH, CommandType.FIND_SUCCESSOR,
+                      CommandType.FIND_SUCCESSORS_BATCH, CommandType.PUT, CommandType.GET, CommandType.DELETE)
 
 
 # class representing a remote peer
 class Remote(Node):
     def __init__(self, address):
         super().__init__(address)
-        self.url = f"http://{self.address.ip}:{self.address.port}/chord/"
+        # messages waiting for the next batch to this peer
+        self.queue = []
+
+    async def send(self, msg, policy=None):
+        cmd = msg['cmd']
+        started = IOLoop.current().time()
+        OUTBOUND_REQUESTS.inc(cmd)
+        try:
+            with client_span(msg, str(self)):
+                if options.coalesce and policy is None and cmd not in UNBATCHED_COMMANDS:
+                    return await self.enqueue(msg)
 
-    @logger_decorator
-    async def send(self, msg, retry_limit=4, exit_on_error=True):
-        retry_count = 0
-        while retry_count < retry_limit:
+                return await self.transmit(msg, policy)
+        except ChordError as e:
+            OUTBOUND_ERRORS.inc(cmd, type(e).__name__)
+            raise
+        finally:
+            OUTBOUND_LATENCY.observe(IOLoop.current().time() - started, cmd)
+
+    async def enqueue(self, msg):
+        # calls to this peer issued within the same loop tick travel together
+        future = gen.Future()
+        if not self.queue:
+            IOLoop.current().add_callback(self.flush)
+
+        self.queue.append((msg, future, time_left()))
+
+        return await future
+
+    async def flush(self):
+        queue, self.queue = self.queue, []
+
+        # a batch is retried as a unit, so only commands retried alike
+        # travel together
+        batches = {}
+        for entry in queue:
+            batches.setdefault(RETRY_POLICIES.get(entry[0]['cmd'], DEFAULT_RETRY_POLICY), []).append(entry)
+
+        await gen.multi([self.transmit_batch(batch, policy) for policy, batch in batches.items()])
+
+    async def transmit_batch(self, queue, policy):
+        # the batch lives as long as its most patient caller
+        budgets = [remaining for _, _, remaining in queue]
+        budget = None if None in budgets else max(budgets)
+
+        with deadline_scope(budget):
             try:
-                msg['frm'] = f"{options.address}:{options.port}"
-                msg['to'] = f'{self.address.ip}:{self.address.port}'
-                client = AsyncHTTPClient()
-                response = await client.fetch(self.url, method='POST', body=json.dumps(msg))
+                if len(queue) == 1:
+                    results = [await self.transmit(queue[0][0], policy)]
+                else:
+                    batch = {'cmd': CommandType.BATCH,
+                             'data': {'commands': [msg for msg, _, _ in queue], 'concurrent': True}}
+                    results = (await self.transmit(batch, policy))['data']
+            except ChordError as e:
+                results = [e.to_result() for _ in queue]
 
-                response = json.loads(response.body)
+        for (_, future, _), result in zip(queue, results):
+            if future.done():
+                continue
 
-                return response
-            except Exception:
-                await gen.sleep(2 ** retry_count)
-                retry_count += 1
+            try:
+                future.set_result(self.check(result))
+            except ChordError as e:
+                future.set_exception(e)
 
-        if exit_on_error:
-            print('Exiting on error...')
-            sys.exit(-1)
+    async def transmit(self, msg, policy=None):
+        policy = policy or RETRY_POLICIES.get(msg['cmd'], DEFAULT_RETRY_POLICY)
+
+        # inherit the deadline of the request we are serving, if any
+        remaining = time_left()
+        expires = IOLoop.current().time() + (REQUEST_DEADLINE if remaining is None else remaining)
+
+        msg['frm'] = f"{options.address}:{options.port}"
+        msg['to'] = f'{self.address.ip}:{self.address.port}'
+
+        for attempt in range(policy.attempts):
+            remaining = expires - IOLoop.current().time()
+            if remaining <= 0:
+                raise DeadlineExceeded(f'{msg["cmd"]} to node {self.identifier()} ran out of time.')
+
+            msg['time_left'] = remaining
+            RPC_ATTEMPTS.inc(msg['cmd'])
+            if attempt:
+                RPC_RETRIES.inc(msg['cmd'])
+            timeout = min(policy.timeout, remaining)
+            try:
+                response = await asyncio.wait_for(self.request(msg), timeout)
+            except (asyncio.TimeoutError, HTTPConnection, OSError, HTTPClientError) as e:
+                # running out of the caller's budget says nothing about the peer
+                if not isinstance(e, asyncio.TimeoutError) or timeout == policy.timeout:
+                    failure_detector.failed(self.address)
+
+                if attempt + 1 < policy.attempts:
+                    # don't sleep past the deadline, it fails right at it
+                    await gen.sleep(min(policy.backoff_delay(attempt), expires - IOLoop.current().time()))
+                continue
+
+            # every answer doubles as a heartbeat
+            failure_detector.heard_from(self.address)
+
+            return self.check(response)
 
         raise HTTPConnection(f'Can not connect to node {self.identifier()} failed.')
 
-    @logger_decorator
+    @staticmethod
+    def check(response):
+        # turn an error reply back into the exception the peer raised
+        error = response.get('error')
+        if error in ERRORS:
+            raise ERRORS[error](response.get('message'))
+        if error:
+            raise RemoteError(f'{error}: {response.get("message")}')
+
+        return response
+
+    async def request(self, msg):
+        return await transport().request(self.address, msg)
+
+    @traced
     async def ping(self):
         try:
             msg = {'cmd': CommandType.PING}
-            await self.send(msg, exit_on_error=False)
+            await self.send(msg)
             return True
 
-        except HTTPConnection:
+        except ChordError:
             return False
 
-    @logger_decorator
+    @traced
+    @single_flight
     async def get_successors(self):
         msg = {'cmd': CommandType.GET_SUCCESSORS}
         response = await self.send(msg)
 
         # if our next guy doesn't have successors, return empty list
-        successors = [Remote(Address(node['ip'], node['port'])) for node in response['data']]
+        successors = [get_remote(Address(node['ip'], node['port'])) for node in response['data']]
 
         return successors
 
-    @logger_decorator
+    @traced
+    @single_flight
     async def get_successor(self):
         msg = {'cmd': CommandType.GET_SUCCESSOR}
         response = await self.send(msg)
 
-        return Remote(Address(response['data']['ip'], response['data']['port']))
+        return get_remote(Address(response['data']['ip'], response['data']['port']))
 
-    @logger_decorator
+    @traced
+    @single_flight
     async def get_predecessor(self):
         msg = {'cmd': CommandType.GET_PREDECESSOR}
         response = await self.send(msg)
 
-        return Remote(Address(response['data']['ip'], response['data']['port'])) if response['data'] else None
+        return get_remote(Address(response['data']['ip'], response['data']['port'])) if response['data'] else None
+
+    @traced
+    @single_flight
+    async def find_successor(self, identifier, recursive=None, cached=True):
+        # leaving `recursive` unset lets the remote node pick its own lookup mode
+        msg = {'cmd': CommandType.FIND_SUCCESSOR,
+               'data': {'identifier': identifier, 'recursive': recursive, 'cached': cached}}
+        response = await self.send(msg)
+
+        return get_remote(Address(response['data']['ip'], response['data']['port']))
 
-    @logger_decorator
-    async def find_successor(self, identifier):
-        msg = {'cmd': CommandType.FIND_SUCCESSOR, 'data': {'identifier': identifier}}
+    @traced
+    async def get_fingers(self):
+        msg = {'cmd': CommandType.GET_FINGERS}
         response = await self.send(msg)
 
-        return Remote(Address(response['data']['ip'], response['data']['port']))
+        return [get_remote(Address(node['ip'], node['port'])) for node in response['data']]
 
-    @logger_decorator
+    @traced
+    async def find_successors(self, identifiers, cached=True):
+        msg = {'cmd': CommandType.FIND_SUCCESSORS_BATCH, 'data': {'identifiers': identifiers, 'cached': cached}}
+        response = await self.send(msg)
+
+        return [get_remote(Address(node['ip'], node['port'])) for node in response['data']]
+
+    @traced
+    @single_flight
     async def get_closest_preceding_finger(self, identifier):
         msg = {'cmd': CommandType.CLOSEST_PRECEDING_FINGER, 'data': {'identifier': identifier}}
         response = await self.send(msg)
 
-        return Remote(Address(response['data']['ip'], response['data']['port']))
+        return get_remote(Address(response['data']['ip'], response['data']['port']))
 
-    @logger_decorator
+    @traced
     async def notify(self, node):
         cmd = {'cmd': CommandType.NOTIFY, 'data': {'ip': node.address.ip, 'port': node.address.port}}
         await self.send(cmd)
 
         return True
+
+    @traced
+    async def suggest_successor(self, node):
+        cmd = {'cmd': CommandType.SUGGEST_SUCCESSOR, 'data': {'ip': node.address.ip, 'port': node.address.port}}
+        await self.send(cmd)
+
+        return True
+
+    @traced
+    async def exchange(self, node):
+        msg = {'cmd': CommandType.STABILIZE, 'data': {'ip': node.address.ip, 'port': node.address.port}}
+        response = await self.send(msg)
+
+        predecessor = response['data']['predecessor']
+        predecessor = get_remote(Address(predecessor['ip'], predecessor['port'])) if predecessor else None
+        successors = [get_remote(Address(node['ip'], node['port'])) for node in response['data']['successors']]
+
+        return predecessor, successors
+
+    @traced
+    async def put(self, key, value, owner=False):
+        msg = {'cmd': CommandType.PUT, 'data': {'key': key, 'value': value, 'owner': owner}}
+        response = await self.send(msg)
+
+        return response['data']
+
+    @traced
+    async def get(self, key, owner=False):
+        msg = {'cmd': CommandType.GET, 'data': {'key': key, 'owner': owner}}
+        response = await self.send(msg)
+
+        return response['data']
+
+    @traced
+    async def delete(self, key, owner=False):
+        msg = {'cmd': CommandType.DELETE, 'data': {'key': key, 'owner': owner}}
+        response = await self.send(msg)
+
+        return response['data']
+
+    @traced
+    async def replica_put(self, key, value, version):
+        msg = {'cmd': CommandType.REPLICA_PUT, 'data': {'key': key, 'value': value, 'version': version}}
+        response = await self.send(msg)
+
+        return response['data']
+
+    @traced
+    async def replica_get(self, key):
+        msg = {'cmd': CommandType.REPLICA_GET, 'data': {'key': key}}
+        response = await self.send(msg)
+
+        value, version = response['data']
+        return value, tuple(version) if version else None
+
+    @traced
+    async def get_digests(self, start, end, level, indices):
+        msg = {'cmd': CommandType.SYNC_DIGESTS,
+               'data': {'start': start, 'end': end, 'level': level, 'indices': indices}}
+        response = await self.send(msg)
+
+        return response['data']
+
+    @traced
+    async def get_entries(self, start, end, leaves):
+        msg = {'cmd': CommandType.SYNC_ENTRIES, 'data': {'start': start, 'end': end, 'leaves': leaves}}
+        response = await self.send(msg)
+
+        return {key: (value, tuple(version)) for key, value, version in response['data']}
+
+    @traced
+    async def transfer(self, entries):
+        msg = {'cmd': CommandType.TRANSFER, 'data': {'entries': entries}}
+        response = await self.send(msg)
+
+        return response['data']
+
+    @traced
+    async def leaving(self, node, predecessor, successors):
+        msg = {'cmd': CommandType.LEAVE, 'data': {
+            'ip': node.address.ip,
+            'port': node.address.port,
+            'predecessor': {'ip': predecessor.address.ip, 'port': predecessor.address.port} if predecessor else None,
+            'successors': [{'ip': node.address.ip, 'port': node.address.port} for node in successors],
+        }}
+        await self.send(msg)
+
+        return True
+
+
+def get_remote(address):
+    # remotes are interned so their connections are reused across calls
+    return registry().get_remote(address, Remote)
@@ -0,0 +1,64 @@
+import asyncio
+import contextvars
+import functools
+
+from core.context import deadline
+from core.tracing import current_span, recording
+
+
+# Concurrent callers asking the same question share a single in-flight call
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, call):
+        expires = deadline.get()
+        flight = self.calls.get(key)
+        if flight is None:
+            # the call belongs to no caller in particular, it must not run
+            # under the first one's deadline or inside its trace span. It
+            # gets a span of its own, which outlives the caller if need be.
+            parent = current_span.get()
+            span = parent.child('single_flight', 'internal', key=repr(key)) if parent else None
+            context = contextvars.Context()
+            context.run(deadline.set, expires)
+            context.run(current_span.set, span or parent)
+            future = asyncio.get_event_loop().create_task(self.run(call, span), context=context)
+            future.add_done_callback(functools.partial(self.done, key))
+            self.calls[key] = future, context
+        else:
+            future, context = flight
+            # it may take as long as its most patient waiter allows
+            current = context.run(deadline.get)
+            if current is not None and (expires is None or expires > current):
+                context.run(deadline.set, expires)
+
+        # one impatient caller must not cancel the call for everybody
+        return await asyncio.shield(future)
+
+    @staticmethod
+    async def run(call, span):
+        if span is None:
+            return await call()
+
+        with recording(span):
+            return await call()
+
+    def done(self, key, future):
+        if self.calls.get(key, (None,))[0] is future:
+            del self.calls[key]
+
+        # the outcome belongs to the waiters, don't warn if they all left
+        if not future.cancelled():
+            future.exception()
+
+
+def single_flight(func):
+    # coalesce concurrent calls of a node method made with the same arguments
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+
+        return await self.in_flight.do(key, functools.partial(func, self, *args, **kwargs))
+
+    return wrapper
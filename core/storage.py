@@ -0,0 +1,588 @@
+import glob
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import zlib
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.options import options
+
+from core.utils import hash_key, is_in_range
+from settings import COMPACTION_BYTES, COMPACTION_INTERVAL, SIZE, SUMMARY_DEPTH, SUMMARY_FANOUT
+
+logger = logging.getLogger('play.' + __name__)
+
+# a log record is the crc32 and length of its json payload, then the payload
+RECORD = struct.Struct('>II')
+
+# an index entry: identifier, hash of the copy, offset and length of its
+# record, and whether it is a live value rather than a tombstone
+INDEX_ENTRY = struct.Struct('>32sQQI?')
+
+
+def entry_hash(key, version):
+    # copies with the same version hold the same value
+    digest = hashlib.blake2b(repr((key, version)).encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest, 'big')
+
+
+# Summary of the copies a store holds, for replicas to find where they
+# differ without comparing them all. The identifier space is split into
+# SUMMARY_FANOUT ** SUMMARY_DEPTH leaves, a tree node hashes the copies
+# under it. Nodes combine with xor instead of rehashing their children,
+# so a write updates one node per level and the tree never gets rebuilt.
+class HashTree:
+    def __init__(self, fanout=SUMMARY_FANOUT, depth=SUMMARY_DEPTH):
+        self.fanout = fanout
+        self.depth = depth
+        # per level, index -> hash of the nodes with copies under them
+        self.levels = [{} for _ in range(depth + 1)]
+        # leaf -> identifiers stored under it
+        self.identifiers = {}
+
+    def index(self, identifier, level):
+        return identifier * self.fanout ** level // SIZE
+
+    def children(self, index):
+        return range(index * self.fanout, (index + 1) * self.fanout)
+
+    def span(self, level, index):
+        # first and last identifier under a node, first > last if none
+        count = self.fanout ** level
+        return -(-index * SIZE // count), -(-(index + 1) * SIZE // count) - 1
+
+    def update(self, identifier, change):
+        # fold the hash of a copy in or out, xor undoes itself
+        for level, hashes in enumerate(self.levels):
+            index = self.index(identifier, level)
+            value = hashes.pop(index, 0) ^ change
+            if value:
+                hashes[index] = value
+
+    def add(self, identifier):
+        self.identifiers.setdefault(self.index(identifier, self.depth), set()).add(identifier)
+
+    def remove(self, identifier):
+        leaf = self.index(identifier, self.depth)
+        self.identifiers[leaf].discard(identifier)
+        if not self.identifiers[leaf]:
+            del self.identifiers[leaf]
+
+    def walk(self, start, end, after=None):
+        # identifiers in [start, end) in ring order from start, skipping
+        # those up to `after`, a leaf at a time so a big store is never
+        # sorted as a whole. The leaf holding start comes up twice when
+        # the range wraps around, first for its part after start.
+        start %= SIZE
+        leaves = self.fanout ** self.depth
+        first = self.index(start, self.depth)
+        done = -1 if after is None else (after - start) % SIZE
+
+        for offset in range(leaves + 1):
+            identifiers = [identifier for identifier in self.leaf_identifiers((first + offset) % leaves, start, end)
+                           if (offset != 0 or identifier >= start) and (offset != leaves or identifier < start)]
+
+            for identifier in sorted(identifiers, key=lambda identifier: (identifier - start) % SIZE):
+                if (identifier - start) % SIZE > done:
+                    yield identifier
+
+    def leaf_identifiers(self, leaf, start, end):
+        return [identifier for identifier in self.identifiers.get(leaf, ()) if is_in_range(identifier, start, end)]
+
+    def digest(self, level, index, start, end, store):
+        # hash of the copies under a node whose identifiers are in [start, end),
+        # only the nodes the range boundaries cut through are recomputed
+        first, last = self.span(level, index)
+        if first > last or not overlaps(first, last, start, end):
+            return 0
+        if contains(first, last, start, end):
+            return self.levels[level].get(index, 0)
+
+        result = 0
+        if level == self.depth:
+            for identifier in self.leaf_identifiers(index, start, end):
+                for key, (_, version) in store.copies(identifier).items():
+                    result ^= entry_hash(key, version)
+        else:
+            for child in self.children(index):
+                result ^= self.digest(level + 1, child, start, end, store)
+
+        return result
+
+
+def contains(first, last, start, end):
+    # whether [start, end) on the ring covers every identifier in [first, last]
+    if start % SIZE == end % SIZE:
+        return True
+
+    return (is_in_range(first, start, end) and is_in_range(last, start, end)
+            and (first - start) % SIZE <= (last - start) % SIZE)
+
+
+def overlaps(first, last, start, end):
+    if start % SIZE == end % SIZE:
+        return True
+
+    return not contains(first, last, end, start)
+
+
+# What every storage engine shares. Every copy carries the version of the
+# write that made it, replicas keep the newest one they are sent so they
+# converge whatever order writes arrive in. Deleting leaves a tombstone
+# behind, an older copy must not bring the key back, until the delete is
+# old enough for every replica to have heard of it and purge forgets it.
+# Engines implement get_version, copies, keep and forget.
+class Store:
+    def __init__(self):
+        self.tree = HashTree()
+        # keys with a live value
+        self.live = 0
+        # key -> version of its tombstone, and the tombstones by version,
+        # stale once the key is written again
+        self.tombstones = {}
+        self.expiring = []
+        # tombstones of deletes made before this time are forgotten
+        self.horizon = 0
+
+    def get(self, key):
+        return self.get_version(key)[0]
+
+    def put(self, key, value, version):
+        # keep the copy unless ours is newer, tell whether the key existed
+        identifier = hash_key(key)
+        current, current_version = self.get_version(key)
+        if value is None and current_version is None and version[0] < self.horizon:
+            # a tombstone we have purged already, it has nothing to delete
+            return False
+
+        if current_version is None or version > current_version:
+            self.keep(identifier, key, value, version)
+            self.live += (value is not None) - (current is not None)
+            self.track(key, value, version)
+
+            change = entry_hash(key, version)
+            if current_version is None:
+                self.tree.add(identifier)
+            else:
+                change ^= entry_hash(key, current_version)
+            self.tree.update(identifier, change)
+
+        return current is not None
+
+    def delete(self, key, version):
+        return self.put(key, None, version)
+
+    def track(self, key, value, version):
+        if value is None:
+            self.tombstones[key] = version
+            heapq.heappush(self.expiring, (version, key))
+        else:
+            self.tombstones.pop(key, None)
+
+    def purge(self, before):
+        # Forget the tombstones of deletes made before `before`, replicas
+        # had until then to learn about them. One that was away for longer
+        # can bring the key back.
+        self.horizon = max(self.horizon, before)
+        purged = 0
+        while self.expiring and self.expiring[0][0][0] < before:
+            version, key = heapq.heappop(self.expiring)
+            if self.tombstones.get(key) != version:
+                continue
+
+            del self.tombstones[key]
+            identifier = hash_key(key)
+            self.forget(identifier, key, version)
+            self.tree.update(identifier, entry_hash(key, version))
+            if not self.copies(identifier):
+                self.tree.remove(identifier)
+            purged += 1
+
+        return purged
+
+    def digests(self, start, end, level, indices):
+        return [self.tree.digest(level, index, start, end, self) for index in indices]
+
+    def entries(self, start, end, leaves):
+        # every copy in the given leaves with an identifier in [start, end)
+        return {key: entry for leaf in leaves for identifier in self.tree.leaf_identifiers(leaf, start, end)
+                for key, entry in self.copies(identifier).items()}
+
+    async def durable(self):
+        # returns once the copies kept so far survive a crash
+        pass
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return self.live
+
+
+# keeps every copy in memory, a restarted node starts out empty
+class MemoryStore(Store):
+    def __init__(self):
+        super().__init__()
+        # identifier -> {key: (value, version)}, the ring is small enough
+        # for keys to collide, tombstones have a None value
+        self.data = {}
+
+    def get_version(self, key):
+        return self.data.get(hash_key(key), {}).get(key, (None, None))
+
+    def copies(self, identifier):
+        return self.data.get(identifier, {})
+
+    def keep(self, identifier, key, value, version):
+        self.data.setdefault(identifier, {})[key] = (value, version)
+
+    def forget(self, identifier, key, version):
+        copies = self.data[identifier]
+        del copies[key]
+        if not copies:
+            del self.data[identifier]
+
+
+def encode_record(key, value, version):
+    payload = json.dumps([key, value, version]).encode()
+
+    return RECORD.pack(zlib.crc32(payload), len(payload)) + payload
+
+
+def decode_record(buffer, offset):
+    # the copy at offset and the size of its record, None at the end of
+    # the buffer or at a torn or corrupt record
+    if offset + RECORD.size > len(buffer):
+        return None
+
+    crc, length = RECORD.unpack_from(buffer, offset)
+    payload = bytes(buffer[offset + RECORD.size:offset + RECORD.size + length])
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+
+    key, value, version = json.loads(payload)
+    return key, value, tuple(version), RECORD.size + length
+
+
+def read_log(path):
+    # the copies in a log, up to the first record a crash left unfinished
+    with open(path, 'rb') as f:
+        buffer = f.read()
+
+    offset = 0
+    while True:
+        record = decode_record(buffer, offset)
+        if record is None:
+            break
+
+        key, value, version, size = record
+        yield key, value, version
+        offset += size
+
+    if offset < len(buffer):
+        logger.warning(f'dropped {len(buffer) - offset} bytes after the last whole record of {path}')
+
+
+def map_file(path):
+    # mmap can't map an empty file
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return b''
+
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Copies sorted by identifier, written once by a compaction and never
+# changed. The index has an entry per copy in the same order, both files
+# are memory mapped so a lookup is a binary search touching a few pages
+# and a range scan reads the data file front to back.
+class Segment:
+    def __init__(self, data_path=None, index_path=None):
+        self.data = map_file(data_path) if data_path else b''
+        self.index = map_file(index_path) if index_path else b''
+        self.count = len(self.index) // INDEX_ENTRY.size
+
+    def entry(self, i):
+        identifier, copy_hash, offset, length, live = INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)
+
+        return int.from_bytes(identifier, 'big'), copy_hash, offset, length, live
+
+    def identifier(self, i):
+        start = i * INDEX_ENTRY.size
+        return int.from_bytes(self.index[start:start + 32], 'big')
+
+    def find(self, identifier):
+        # first entry at or after identifier
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.identifier(middle) < identifier:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def copies(self, identifier):
+        copies = {}
+        i = self.find(identifier)
+        while i < self.count and self.identifier(i) == identifier:
+            key, value, version, _ = decode_record(self.data, self.entry(i)[2])
+            copies[key] = (value, version)
+            i += 1
+
+        return copies
+
+    def groups(self):
+        # (identifier, copies) in identifier order
+        i = 0
+        while i < self.count:
+            identifier = self.identifier(i)
+            copies = self.copies(identifier)
+            yield identifier, copies
+            i += len(copies)
+
+    def close(self):
+        for buffer in (self.data, self.index):
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+
+
+# Keeps copies on disk in the directory at `path`. Writes are appended to
+# a tail log of crc'd records and kept in memory until the tail reaches
+# compaction_bytes, or compaction_interval passed, then a compaction
+# merges it with the base segment into a new one. The writes of one loop
+# tick share an fsync, durable() waits for it. A restarted node maps the
+# base and its index, rebuilds the hash tree from the index alone and
+# only replays the tail. Purged tombstones are masked until a compaction
+# leaves them out of the base.
+class LogStore(Store):
+    def __init__(self, path, compaction_bytes=COMPACTION_BYTES, compaction_interval=COMPACTION_INTERVAL):
+        super().__init__()
+        self.path = path
+        self.compaction_bytes = compaction_bytes
+        self.compaction_interval = compaction_interval
+        self.compacted = IOLoop.current().time()
+        # resolved by the fsync of the writes made since the last one
+        self.committing = None
+        os.makedirs(path, exist_ok=True)
+
+        # copies written since the last compaction, and those being
+        # compacted, identifier -> {key: (value, version)}
+        self.recent = {}
+        self.frozen = {}
+        self.compacting = False
+        # key -> version of a purged tombstone still in one of them
+        self.purged = {}
+
+        # a base is complete once its index exists, it is renamed last
+        bases = self.numbers('base-*.index')
+        number = bases[-1] if bases else 0
+        self.base = Segment(*self.base_paths(number)) if number else Segment()
+        for i in range(self.base.count):
+            identifier, copy_hash, offset, _, live = self.base.entry(i)
+            self.tree.add(identifier)
+            self.tree.update(identifier, copy_hash)
+            self.live += live
+            if not live:
+                key, value, version, _ = decode_record(self.base.data, offset)
+                self.track(key, value, version)
+
+        # the tails written since go into a fresh one, then they go away
+        tails = self.numbers('tail-*.log')
+        self.tail_number = max(tails + [number]) + 1
+        self.tail = open(self.tail_path(self.tail_number), 'ab')
+        self.tail_bytes = 0
+        for tail in tails:
+            if tail > number:
+                for key, value, version in read_log(self.tail_path(tail)):
+                    self.put(key, value, version)
+        self.sync()
+
+        for tail in tails:
+            os.remove(self.tail_path(tail))
+        self.remove_bases(number)
+
+    def numbers(self, pattern):
+        names = glob.glob(os.path.join(self.path, pattern))
+
+        return sorted(int(re.search(r'(\d+)\.', os.path.basename(name)).group(1)) for name in names)
+
+    def base_paths(self, number):
+        return os.path.join(self.path, f'base-{number:08d}.data'), os.path.join(self.path, f'base-{number:08d}.index')
+
+    def tail_path(self, number):
+        return os.path.join(self.path, f'tail-{number:08d}.log')
+
+    def remove_bases(self, keep):
+        # older bases and whatever an interrupted compaction left behind
+        for name in glob.glob(os.path.join(self.path, 'base-*')):
+            if name not in self.base_paths(keep):
+                os.remove(name)
+
+    def get_version(self, key):
+        identifier = hash_key(key)
+        for layer in (self.recent, self.frozen):
+            copy = layer.get(identifier, {}).get(key)
+            if copy:
+                break
+        else:
+            copy = self.base.copies(identifier).get(key, (None, None))
+
+        # the newest copy was purged, the older ones it replaced are gone too
+        return (None, None) if self.purged.get(key) == copy[1] else copy
+
+    def copies(self, identifier):
+        copies = self.base.copies(identifier)
+        copies.update(self.frozen.get(identifier, {}))
+        copies.update(self.recent.get(identifier, {}))
+
+        return {key: copy for key, copy in copies.items() if self.purged.get(key) != copy[1]}
+
+    def keep(self, identifier, key, value, version):
+        record = encode_record(key, value, version)
+        self.tail.write(record)
+        self.tail_bytes += len(record)
+        self.recent.setdefault(identifier, {})[key] = (value, version)
+
+        if self.committing is None:
+            self.committing = Future()
+            IOLoop.current().add_callback(self.commit)
+
+        if self.tail_bytes >= self.compaction_bytes and not self.compacting:
+            IOLoop.current().add_callback(self.compact)
+
+    def forget(self, identifier, key, version):
+        # the layers can't drop a copy without uncovering an older one below
+        self.purged[key] = version
+
+    def purge(self, before):
+        purged = super().purge(before)
+
+        # an idle store never fills its tail, purged tombstones and the
+        # copies under them would stay on disk for good
+        if IOLoop.current().time() - self.compacted >= self.compaction_interval:
+            IOLoop.current().add_callback(self.compact)
+
+        return purged
+
+    def commit(self):
+        # one fsync for every write of the last loop tick, unless closing
+        # the store made it already
+        committing, self.committing = self.committing, None
+        if committing is None:
+            return
+
+        try:
+            self.sync()
+        except OSError as e:
+            committing.set_exception(e)
+        else:
+            committing.set_result(None)
+
+    async def durable(self):
+        if self.committing is not None:
+            await self.committing
+
+    def sync(self):
+        self.tail.flush()
+        os.fsync(self.tail.fileno())
+
+    async def compact(self):
+        # Writes move on to a fresh tail while the full one is merged with
+        # the base in a thread, the event loop keeps serving meanwhile
+        if self.compacting or not (self.recent or self.purged):
+            return
+
+        self.compacting = True
+        self.frozen, self.recent = self.recent, {}
+        purged = dict(self.purged)
+        number = self.tail_number
+        self.sync()
+        self.tail.close()
+        self.tail_number += 1
+        self.tail = open(self.tail_path(self.tail_number), 'ab')
+        self.tail_bytes = 0
+
+        try:
+            await IOLoop.current().run_in_executor(None, self.merge, number, purged)
+        except OSError as e:
+            # the frozen tail is still on disk, keep serving its copies
+            logger.error(f'compaction of {self.path} failed: {e}')
+            for identifier, copies in self.frozen.items():
+                recent = self.recent.setdefault(identifier, {})
+                for key, copy in copies.items():
+                    recent.setdefault(key, copy)
+        else:
+            base, self.base = self.base, Segment(*self.base_paths(number))
+            base.close()
+            for key, version in purged.items():
+                if self.purged.get(key) == version:
+                    del self.purged[key]
+            self.remove_bases(number)
+            for tail in self.numbers('tail-*.log'):
+                if tail <= number:
+                    os.remove(self.tail_path(tail))
+        finally:
+            self.frozen = {}
+            self.compacting = False
+            self.compacted = IOLoop.current().time()
+
+    def merge(self, number, purged):
+        # write the base and the frozen copies, in identifier order, as
+        # base `number`, leaving out the purged ones. Runs in a thread,
+        # neither of them changes meanwhile.
+        frozen = ((identifier, self.frozen[identifier]) for identifier in sorted(self.frozen))
+        groups = heapq.merge(self.base.groups(), frozen, key=lambda group: group[0])
+
+        data_path, index_path = self.base_paths(number)
+        with open(data_path + '.tmp', 'wb') as data, open(index_path + '.tmp', 'wb') as index:
+            offset = 0
+            for identifier, layers in itertools.groupby(groups, key=lambda group: group[0]):
+                # merge is stable, frozen copies replace those of the base
+                copies = {}
+                for _, layer in layers:
+                    copies.update(layer)
+
+                for key, (value, version) in copies.items():
+                    if purged.get(key) == version:
+                        continue
+
+                    record = encode_record(key, value, version)
+                    data.write(record)
+                    index.write(INDEX_ENTRY.pack(identifier.to_bytes(32, 'big'), entry_hash(key, version), offset,
+                                                 len(record), value is not None))
+                    offset += len(record)
+
+            for f in (data, index):
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.replace(data_path + '.tmp', data_path)
+        os.replace(index_path + '.tmp', index_path)
+
+    def close(self):
+        self.sync()
+        self.tail.close()
+        self.base.close()
+
+        # writes waiting for their fsync just had it
+        committing, self.committing = self.committing, None
+        if committing is not None:
+            committing.set_result(None)
+
+
+def open_store(address):
+    # the storage engine named by --store, each node in a directory of its own
+    if options.store == 'log':
+        return LogStore(os.path.join(options.data_dir, f'{address.ip}-{address.port}'))
+
+    return MemoryStore()
@@ -0,0 +1,139 @@
+import json
+import struct
+
+from tornado import gen, httputil
+from tornado.http1connection import HTTP1Connection, HTTP1ConnectionParameters
+from tornado.httpclient import HTTPClientError
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.tcpclient import TCPClient
+
+from core.exceptions import HTTPConnection
+from settings import STREAM_PORT_OFFSET
+
+# every frame starts with its payload length and the request id it belongs to
+HEADER = struct.Struct('!II')
+MAX_REQUEST_ID = 1 << 32
+
+
+def encode_frame(request_id, msg):
+    payload = json.dumps(msg, separators=(',', ':')).encode()
+    return HEADER.pack(len(payload), request_id) + payload
+
+
+async def read_frame(stream):
+    length, request_id = HEADER.unpack(await stream.read_bytes(HEADER.size))
+    payload = await stream.read_bytes(length)
+
+    return request_id, json.loads(payload)
+
+
+def stream_port(address):
+    return int(address.port) + STREAM_PORT_OFFSET
+
+
+# a long-lived connection to a peer, concurrent requests are multiplexed
+# over it and matched with their responses by request id
+class StreamConnection:
+    def __init__(self, stream):
+        self.stream = stream
+        self.request_id = 0
+        self.pending = {}
+        IOLoop.current().add_callback(self.read_responses)
+
+    @classmethod
+    async def connect(cls, address):
+        stream = await TCPClient().connect(address.ip, stream_port(address))
+        stream.set_nodelay(True)
+
+        return cls(stream)
+
+    def closed(self):
+        return self.stream.closed()
+
+    async def request(self, msg):
+        self.request_id = (self.request_id + 1) % MAX_REQUEST_ID
+        request_id = self.request_id
+
+        future = self.pending[request_id] = gen.Future()
+        try:
+            await self.stream.write(encode_frame(request_id, msg))
+            return await future
+        except StreamClosedError:
+            raise HTTPConnection(f'Connection to {self.stream} closed.')
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def read_responses(self):
+        try:
+            while True:
+                request_id, response = await read_frame(self.stream)
+                future = self.pending.get(request_id)
+                if future and not future.done():
+                    future.set_result(response)
+        except StreamClosedError:
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(HTTPConnection('Connection closed.'))
+
+
+class Response(httputil.HTTPMessageDelegate):
+    # an http response as it is read off a connection
+    def __init__(self):
+        self.code = None
+        self.headers = None
+        self.chunks = []
+
+    def headers_received(self, start_line, headers):
+        self.code = start_line.code
+        self.headers = headers
+
+    def data_received(self, chunk):
+        self.chunks.append(chunk)
+
+
+# An http/1.1 connection to a peer's http port, kept open between
+# requests. It carries one request at a time, the pool hands it to the
+# next one once the last response was read in full.
+class KeepAliveConnection:
+    def __init__(self, stream, host):
+        self.stream = stream
+        self.host = host
+
+    @classmethod
+    async def connect(cls, address):
+        stream = await TCPClient().connect(address.ip, address.port)
+        stream.set_nodelay(True)
+
+        return cls(stream, f'{address.ip}:{address.port}')
+
+    def closed(self):
+        return self.stream.closed()
+
+    async def request(self, path, body):
+        connection = HTTP1Connection(self.stream, True, HTTP1ConnectionParameters())
+        headers = httputil.HTTPHeaders({'Host': self.host, 'Content-Type': 'application/json',
+                                        'Content-Length': str(len(body))})
+        response = Response()
+        try:
+            connection.write_headers(httputil.RequestStartLine('POST', path, 'HTTP/1.1'), headers, body)
+            connection.finish()
+            await connection.read_response(response)
+        except StreamClosedError:
+            raise HTTPConnection(f'Connection to {self.host} closed.')
+        except BaseException:
+            # given up on halfway, e.g. timed out, the rest of the response
+            # would be taken for the answer to the next request
+            self.stream.close()
+            raise
+
+        if response.code is None:
+            raise HTTPConnection(f'Connection to {self.host} closed.')
+        if response.headers.get('Connection', '').lower() == 'close':
+            self.stream.close()
+        if response.code >= 400:
+            raise HTTPClientError(response.code)
+
+        return b''.join(response.chunks)
@@ -0,0 +1,237 @@
+import atexit
+import functools
+import json
+import logging
+import random
+import sys
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+from tornado.ioloop import IOLoop
+from tornado.options import options
+
+from settings import TRACE_BUFFER_SIZE
+
+logger = logging.getLogger('play.trace')
+
+# the span the running task works for, None at the start of a lookup and
+# False while serving an rpc that is not part of a trace
+current_span = ContextVar('span', default=None)
+
+# OTLP span kinds
+KINDS = {'internal': 1, 'server': 2, 'client': 3}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(dict(time=record.created, call=record.getMessage(), **record.trace))
+
+
+class DeferredQueueHandler(QueueHandler):
+    # hand records over untouched, the listener thread formats them
+    def prepare(self, record):
+        return record
+
+
+def start():
+    # trace records go through a queue, a thread writes them out so the
+    # event loop never waits on the terminal
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+
+    queue = SimpleQueue()
+    _listener = QueueListener(queue, handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logger.addHandler(DeferredQueueHandler(queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# Trace calls to a node method as one json line each, for a sample of the
+# calls. Whether to trace is decided once, when the decorated method is
+# defined, untraced methods are returned as they are and cost nothing.
+def traced(func):
+    if not options.show_more:
+        return func
+
+    start()
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        if random.random() >= options.trace_sample:
+            return await func(self, *args, **kwargs)
+
+        started = IOLoop.current().time()
+        fields = {'node': str(self), 'args': repr(args), 'kwargs': repr(kwargs)}
+        span = current_span.get()
+        if span:
+            fields['trace_id'] = span.trace_id
+        try:
+            result = await func(self, *args, **kwargs)
+        except Exception as e:
+            fields['error'] = repr(e)
+            raise
+        else:
+            fields['result'] = repr(result)
+            return result
+        finally:
+            fields['seconds'] = IOLoop.current().time() - started
+            logger.info(name, extra={'trace': fields})
+
+    return wrapper
+
+
+# One step of a distributed lookup. A trace starts at the node a lookup
+# begins on, every rpc it sends is a client span and serving that rpc on
+# the peer a server span, linked through the ids carried in the message.
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'node', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, name, kind, node, trace_id=None, parent_id=None, **attributes):
+        self.trace_id = trace_id or '%032x' % random.getrandbits(128)
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.node = node
+        self.start = IOLoop.current().time()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    def child(self, name, kind, **attributes):
+        return Span(name, kind, self.node, self.trace_id, self.span_id, **attributes)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'node': self.node,
+            'start': self.start,
+            'seconds': self.end - self.start,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': KINDS[self.kind],
+            'startTimeUnixNano': str(int(self.start * 1e9)),
+            'endTimeUnixNano': str(int(self.end * 1e9)),
+            'attributes': [{'key': key, 'value': {'stringValue': str(value)}}
+                           for key, value in dict(self.attributes, node=self.node).items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+
+        return span
+
+
+# The latest finished spans, older ones fall off the end. Nodes in one
+# process (the simulator) share it, so it holds whole traces there.
+class SpanBuffer:
+    def __init__(self, size=TRACE_BUFFER_SIZE):
+        self.spans = deque(maxlen=size)
+
+    def record(self, span):
+        self.spans.append(span)
+
+    def clear(self):
+        self.spans.clear()
+
+    def find(self, trace_id=None):
+        return [span for span in self.spans if trace_id is None or span.trace_id == trace_id]
+
+    def to_json(self, trace_id=None):
+        return {'spans': [span.to_dict() for span in self.find(trace_id)]}
+
+    def to_otlp(self, trace_id=None):
+        # the json encoding of an OTLP ExportTraceServiceRequest
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'chord'}}]},
+            'scopeSpans': [{'scope': {'name': 'chord'}, 'spans': [span.to_otlp() for span in self.find(trace_id)]}],
+        }]}
+
+
+spans = SpanBuffer()
+
+
+@contextmanager
+def recording(span):
+    # make `span` the current one while the block runs
+    token = current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        current_span.reset(token)
+        span.end = IOLoop.current().time()
+        spans.record(span)
+
+
+def starts_trace(func):
+    # a sample of the lookups started on this node begin a trace
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        if current_span.get() is not None or random.random() >= options.trace_lookups:
+            return await func(self, *args, **kwargs)
+
+        with recording(Span(func.__name__, 'internal', str(self), args=repr(args))) as span:
+            result = await func(self, *args, **kwargs)
+            span.attributes['result'] = repr(result)
+
+            return result
+
+    return wrapper
+
+
+@contextmanager
+def client_span(msg, peer):
+    # a span for sending `msg` to `peer`, its ids travel along in the message
+    parent = current_span.get()
+    if not parent:
+        yield
+        return
+
+    with recording(parent.child(msg['cmd'], 'client', peer=peer)) as span:
+        msg['trace'] = {'trace_id': span.trace_id, 'parent_id': span.span_id}
+        yield
+
+
+@contextmanager
+def server_span(node, command):
+    # a span for serving a command that came in as part of a trace, other
+    # commands neither continue a trace nor start one, whatever context
+    # the transport runs them in
+    context = command.get('trace')
+    if context is None:
+        token = current_span.set(False)
+        try:
+            yield
+        finally:
+            current_span.reset(token)
+        return
+
+    with recording(Span(command['cmd'], 'server', str(node), context['trace_id'], context['parent_id'])):
+        yield
@@ -0,0 +1,79 @@
+import json
+
+from tornado import gen
+from tornado.options import options
+
+from core.dispatch import dispatch
+from core.exceptions import HTTPConnection
+from core.peers import registry
+
+
+# How a command reaches the node at `address`. Remote picks the transport
+# named by --transport, retries, timeouts and the failure detector stay
+# in Remote so every transport behaves the same to the routing code.
+class Transport:
+    async def request(self, address, msg):
+        raise NotImplementedError
+
+
+class HTTPTransport(Transport):
+    async def request(self, address, msg):
+        response = await registry().pool(address).fetch('/chord/', json.dumps(msg).encode())
+
+        return json.loads(response)
+
+
+class TCPTransport(Transport):
+    async def request(self, address, msg):
+        return await registry().pool(address).request(msg)
+
+
+# Nodes living in this process, commands are dispatched straight into the
+# target's execute_command. Used by the simulator and the tests, where
+# thousands of nodes share one event loop.
+class LoopbackTransport(Transport):
+    def __init__(self):
+        self.nodes = {}
+        # one way delay of a message in seconds, simulators replace it
+        self.latency = lambda: 0
+        # commands delivered, by type
+        self.delivered = {}
+
+    def register(self, node):
+        self.nodes[node.address] = node
+
+    def unregister(self, address):
+        self.nodes.pop(address, None)
+
+    async def request(self, address, msg):
+        delay = self.latency()
+        if delay:
+            await gen.sleep(delay)
+
+        node = self.nodes.get(address)
+        if node is None:
+            raise HTTPConnection(f'Nobody listens on {address.ip}:{address.port}.')
+
+        self.delivered[msg['cmd']] = self.delivered.get(msg['cmd'], 0) + 1
+        # the sender keeps using its message for retries, hand over a copy
+        # like the wire would
+        response = await dispatch(node, dict(msg))
+
+        delay = self.latency()
+        if delay:
+            await gen.sleep(delay)
+
+        return response
+
+
+loopback = LoopbackTransport()
+
+TRANSPORTS = {
+    'http': HTTPTransport(),
+    'tcp': TCPTransport(),
+    'loopback': loopback,
+}
+
+
+def transport():
+    return TRANSPORTS[options.transport]
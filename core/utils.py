@@ -1,7 +1,10 @@
-import functools
+import asyncio
+import hashlib
 
-from tornado.options import options
+from tornado import gen
+from tornado.ioloop import IOLoop
 
+from core.exceptions import ChordError
 from settings import SIZE
 
 
@@ -19,34 +22,109 @@ def is_in_range(c, a, b):
     return a <= c or c < b
 
 
+# Helper function to map an arbitrary key onto the ring
+def hash_key(key):
+    m = hashlib.sha256()
+    m.update(str(key).encode())
+    return int(m.hexdigest(), 16) % SIZE
+
+
+# Ping all candidates at once and return the first one, in order of
+# preference, that answers before the timeout
+async def first_alive(nodes, timeout):
+    deadline = IOLoop.current().time() + timeout
+    probes = [asyncio.ensure_future(node.ping()) for node in nodes]
+
+    try:
+        for node, probe in zip(nodes, probes):
+            try:
+                if await gen.with_timeout(deadline, probe):
+                    return node
+            except gen.TimeoutError:
+                # out of time, settle for any later candidate that already answered
+                for node, answered in zip(nodes, probes):
+                    if answered.done() and not answered.cancelled() and answered.result():
+                        return node
+
+                return None
+    finally:
+        for probe in probes:
+            probe.cancel()
+
+    return None
+
+
+# Call `width` of the candidates at once, each failed call makes room for
+# the next candidate, until `needed` calls succeeded or nobody is left.
+# Returns the (candidate, result) pairs that succeeded, calls still
+# running at that point finish in the background.
+async def quorum(call, candidates, needed, width=None):
+    candidates = iter(candidates)
+    running = {}
+
+    def launch():
+        candidate = next(candidates, None)
+        if candidate is not None:
+            future = asyncio.ensure_future(call(candidate))
+            # nobody may be left to look at its outcome
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            running[future] = candidate
+
+    for _ in range(width or needed):
+        launch()
+
+    results = []
+    while running and len(results) < needed:
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            candidate = running.pop(future)
+            error = future.exception()
+            if error is None:
+                results.append((candidate, future.result()))
+            elif isinstance(error, ChordError):
+                launch()
+            else:
+                raise error
+
+    return results
+
+
+# Interval of a maintenance task, it backs off while rounds find nothing to
+# repair and snaps back to the minimum as soon as something changes
+class AdaptiveInterval:
+    def __init__(self, minimum, maximum, factor):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.current = minimum
+
+    def reset(self):
+        self.current = self.minimum
+
+    def back_off(self):
+        self.current = min(self.maximum, self.current * self.factor)
+
+
 class CommandType:
     # just for ease of debugging I use this verbose name
     GET_SUCCESSOR = 'GET_SUCCESSOR'
     FIND_SUCCESSOR = 'FIND_SUCCESSOR'
+    FIND_SUCCESSORS_BATCH = 'FIND_SUCCESSORS_BATCH'
     GET_PREDECESSOR = 'GET_PREDECESSOR'
     CLOSEST_PRECEDING_FINGER = 'CLOSEST_PRECEDING_FINGER'
     NOTIFY = 'NOTIFY'
+    SUGGEST_SUCCESSOR = 'SUGGEST_SUCCESSOR'
+    STABILIZE = 'STABILIZE'
     GET_SUCCESSORS = 'GET_SUCCESSORS'
+    GET_FINGERS = 'GET_FINGERS'
     PING = 'PING'
-
-
-def logger_decorator(func):
-    @functools.wraps(func)
-    async def wrapper(self, *args, **kwargs):
-        try:
-
-            if options.show_more:
-
-                print(f'[{self}] -> {func.__qualname__}({args} {kwargs})')
-
-                result = await func(self, *args, **kwargs)
-
-                print(f'[{self}] -> {func.__qualname__}({args} {kwargs}) -> {result}')
-            else:
-                result = await func(self, *args, **kwargs)
-
-            return result
-        except Exception as e:
-            print(f'Exception: {e}')
-
-    return wrapper
+    PUT = 'PUT'
+    GET = 'GET'
+    DELETE = 'DELETE'
+    REPLICA_PUT = 'REPLICA_PUT'
+    REPLICA_GET = 'REPLICA_GET'
+    SYNC_DIGESTS = 'SYNC_DIGESTS'
+    SYNC_ENTRIES = 'SYNC_ENTRIES'
+    TRANSFER = 'TRANSFER'
+    LEAVE = 'LEAVE'
+    BATCH = 'BATCH'
@@ -1,5 +1,11 @@
 import logging
 
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.tcpserver import TCPServer
+
+from core.dispatch import dispatch
+from core.stream import encode_frame, read_frame
 from handlers.base import JsonHandler
 
 logger = logging.getLogger('play.' + __name__)
@@ -13,6 +19,41 @@ class ChordHandler(JsonHandler):
     async def post(self):
         command = self.request.arguments
 
-        self.response = await self.node.execute_command(command)
+        self.response = await dispatch(self.node, command)
 
         return self.write_json()
+
+
+class ChordStreamServer(TCPServer):
+    """Serves chord commands over long-lived framed tcp connections."""
+
+    def __init__(self, node, **kwargs):
+        super().__init__(**kwargs)
+        self.node = node
+        self.streams = set()
+
+    def stop(self):
+        # stop listening and drop the connections peers keep open
+        super().stop()
+        for stream in list(self.streams):
+            stream.close()
+
+    async def handle_stream(self, stream, address):
+        stream.set_nodelay(True)
+        self.streams.add(stream)
+        try:
+            while True:
+                request_id, command = await read_frame(stream)
+                # requests are multiplexed, answer them as they complete
+                IOLoop.current().add_callback(self.execute, stream, request_id, command)
+        except StreamClosedError:
+            pass
+        finally:
+            self.streams.discard(stream)
+
+    async def execute(self, stream, request_id, command):
+        response = await dispatch(self.node, command)
+        try:
+            await stream.write(encode_frame(request_id, response))
+        except StreamClosedError:
+            logger.info(f'connection closed before replying to {command.get("frm")}')
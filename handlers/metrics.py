@@ -0,0 +1,20 @@
+import tornado.web
+
+from core.metrics import FINGERS, LOOKUP_CACHE_ENTRIES, PREDECESSOR_KNOWN, SUCCESSORS, registry
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Exposes the node's metrics in the prometheus text format."""
+
+    def initialize(self, node):
+        self.node = node
+
+    def get(self):
+        # the node's state is only read when somebody asks for it
+        FINGERS.set(len(self.node.finger.nodes()))
+        SUCCESSORS.set(len(self.node.successors))
+        PREDECESSOR_KNOWN.set(int(self.node.predecessor is not None))
+        LOOKUP_CACHE_ENTRIES.set(len(self.node.lookup_cache.entries))
+
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(registry.render())
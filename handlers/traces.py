@@ -0,0 +1,17 @@
+from core.tracing import spans
+from handlers.base import JsonHandler
+
+
+class TracesHandler(JsonHandler):
+    """Serves the spans of sampled lookups this node took part in."""
+
+    def get(self):
+        # ?trace_id= narrows it down to one trace, ?format=otlp gives the
+        # OTLP json encoding collectors import
+        trace_id = self.get_argument('trace_id', None)
+        if self.get_argument('format', None) == 'otlp':
+            self.response = spans.to_otlp(trace_id)
+        else:
+            self.response = spans.to_json(trace_id)
+
+        self.write_json()
@@ -13,21 +13,70 @@ env = Env()
 env.read_env()  # read .env file, if it exists
 
 ########
-# log size of the ring
-LOGSIZE = 3
-SIZE = 1 << LOGSIZE
-
 # successors list size (to continue operating on node failures)
 NUMBER_OF_SUCCESSORS = 4
 
-# Stabilize
+# Stabilize, backing off up to the max interval while the ring is quiet
 STABILIZE_INTERVAL = 1
+STABILIZE_MAX_INTERVAL = 16
 
 # Fix Fingers
 FIX_FINGERS_INTERVAL = 4
+FIX_FINGERS_MAX_INTERVAL = 64
+
+# Anti-entropy, replicas compare their copies of a node's range
+SYNC_INTERVAL = 8
+SYNC_MAX_INTERVAL = 128
+
+# tombstones are purged once the delete is this old, replicas must have
+# synced with each other within it or a deleted key can come back
+TOMBSTONE_GRACE = 24 * 60 * 60
+
+# shape of the hash tree summarizing a store, replicas compare it level
+# by level and only exchange the copies under leaves that differ
+SUMMARY_FANOUT = 16
+SUMMARY_DEPTH = 3
+
+# a log store merges its tail log into a new base once the tail grows this
+# big, or once this many seconds passed, so purged tombstones leave the disk
+COMPACTION_BYTES = 64 * 1024 * 1024
+COMPACTION_INTERVAL = 3600
+
+# copies per chunk of a range handed over to another node, the next chunk
+# is only sent once the last one was acknowledged
+TRANSFER_CHUNK_SIZE = 128
+
+# growth of a maintenance interval after a round without changes
+INTERVAL_BACKOFF = 2
+
+# how long concurrent liveness probes wait for an answer
+PROBE_TIMEOUT = 1
+
+# per attempt timeout of an rpc, and the end-to-end time budget of a request
+RPC_TIMEOUT = 3
+REQUEST_DEADLINE = 10
+
+# heartbeats of the failure detector, a peer is suspected after
+# SUSPECT_AFTER_FAILURES failed rpcs in a row. Peers that answered an rpc
+# since the last round need none, rounds back off while nobody fails.
+HEARTBEAT_INTERVAL = 1
+HEARTBEAT_MAX_INTERVAL = 16
+SUSPECT_AFTER_FAILURES = 2
 
-# Update Successors
-UPDATE_SUCCESSORS_INTERVAL = 1
+# lookup results cached by identifier range, entries older than the
+# ttl are confirmed with their owner before use
+LOOKUP_CACHE_SIZE = 1024
+LOOKUP_CACHE_TTL = 30
+
+# the tcp transport listens on the http port shifted by this offset
+STREAM_PORT_OFFSET = 1000
+
+# connection pooling between peers
+MAX_CONNECTIONS_PER_PEER = 4
+PEER_IDLE_TIMEOUT = 60
+
+# finished spans of sampled lookups kept in memory for /traces/
+TRACE_BUFFER_SIZE = 4096
 ########
 
 
@@ -42,10 +91,42 @@ define("debug", default=True, help="debug mode")
 define("bootstrap_address", default='127.0.0.1', help="bootstrap node address")
 define("bootstrap_port", default='9000', help="bootstrap node port")
 define("is_bootstrap", default=False, help="a bootstrapping node")
-define("show_more", default=False, help="a bootstrapping node")
+define("logsize", default=env.int('CHORD_LOGSIZE', 3), type=int,
+       help="log size of the ring, identifiers are LOGSIZE bits long")
+define("show_more", default=False, type=bool, help="trace calls of node methods as json lines on stderr")
+define("trace_sample", default=1.0, type=float, help="fraction of calls traced with show_more")
+define("trace_lookups", default=0.01, type=float, help="fraction of lookups traced hop by hop, served on /traces/")
+define("coalesce", default=True, type=bool, help="send rpcs issued to the same peer within one loop tick as a batch")
+define("lookup", default='iterative', help="find_successor routing, 'iterative' or 'recursive'")
+define("probe", default='concurrent', help="liveness probing of routing candidates, 'concurrent' or 'sequential'")
+define("transport", default='http', help="rpc transport between nodes, 'http', 'tcp' or 'loopback'")
+define("fingers", default='table', help="fingers refreshed per fix_fingers round, 'table' or 'random'")
+define("replicas", default=3, type=int,
+       help=f"copies of every key, on its owner and the successors after it, at most {NUMBER_OF_SUCCESSORS}")
+define("write_quorum", default=2, type=int, help="replicas that must acknowledge a write")
+define("read_quorum", default=2, type=int, help="replicas asked on a read, the newest copy wins")
+define("store", default='memory', help="storage engine of the node, 'memory' or 'log' to keep copies on disk")
+define("data_dir", default=path(ROOT, 'data'), help="directory log stores keep their files in, one per node")
+
+# simulator.py, a whole ring on one event loop in virtual time
+define("sim_nodes", default=1000, type=int, help="nodes in the simulated ring")
+define("sim_build", default='oracle', help="start from a converged ring, 'oracle', or let nodes 'join' one by one")
+define("sim_duration", default=60, type=float, help="virtual seconds to run the ring for")
+define("sim_latency", default=0.01, type=float, help="mean one way message latency, in seconds")
+define("sim_jitter", default=0.005, type=float, help="latency varies uniformly by up to this many seconds")
+define("sim_churn", default=0, type=float, help="node failures and joins per virtual second")
+define("sim_lookups", default=1000, type=int, help="lookups checked against the true owners at the end")
+define("sim_seed", default=None, type=int, help="random seed, for repeatable runs")
 
 tornado.options.parse_command_line()
 
+if options.config:
+    tornado.options.parse_config_file(options.config)
+
+# log size of the ring, use 160 for production sized identifier spaces
+LOGSIZE = options.logsize
+SIZE = 1 << LOGSIZE
+
 MEDIA_ROOT = path(ROOT, 'media')
 TEMPLATE_ROOT = path(ROOT, 'templates')
 
@@ -85,6 +166,3 @@ else:
 USE_SYSLOG = True
 
 logconfig.initialize_logging(SYSLOG_TAG, SYSLOG_FACILITY, LOGGERS, LOG_LEVEL, USE_SYSLOG)
-
-if options.config:
-    tornado.options.parse_config_file(options.config)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""Runs a whole chord ring inside one process, in virtual time.
+
+Nodes talk over the loopback transport, so thousands of them fit on one
+event loop, and the loop's clock jumps from timer to timer instead of
+waiting for them. Example:
+
+    python simulator.py --logsize=32 --sim_nodes=10000 --sim_churn=1
+
+which takes a few minutes on one core.
+
+Nodes share the process wide failure detector, a peer one node suspects
+is suspected by all of them.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import random
+from bisect import bisect_left, insort
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.options import options
+from tornado.platform.asyncio import AsyncIOMainLoop
+
+from core.address import Address
+from core.exceptions import ChordError
+from core.local import Local
+from core.remote import get_remote
+from core.transport import loopback
+from settings import LOGSIZE, NUMBER_OF_SUCCESSORS, REQUEST_DEADLINE, SIZE
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    # The clock only moves when nothing is ready to run, then it skips
+    # straight to the next timer. Relies on the internals of asyncio's
+    # base event loop, which is why it lives in the simulator only.
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def _run_once(self):
+        # cancelled timers would be skipped to and then dropped, leaving
+        # the loop to wait for the next one on the wall clock
+        while self._scheduled and self._scheduled[0].cancelled():
+            self._timer_cancelled_count -= 1
+            heapq.heappop(self._scheduled)._scheduled = False
+
+        if not self._ready and self._scheduled:
+            self.now = max(self.now, self._scheduled[0].when())
+
+        super()._run_once()
+
+
+class VirtualTimeIOLoop(AsyncIOMainLoop):
+    # tornado reads the wall clock by default, the nodes must see the
+    # virtual one
+    def time(self):
+        return self.asyncio_loop.time()
+
+
+class Simulator:
+    def __init__(self, latency=0, jitter=0, seed=None):
+        self.random = random.Random(seed)
+        self.created = 0
+        # live nodes by identifier, and their sorted identifiers
+        self.nodes = {}
+        self.identifiers = []
+
+        loopback.latency = lambda: max(0, latency + self.random.uniform(-jitter, jitter))
+        options.transport = 'loopback'
+
+    def new_node(self, bootstrap=None):
+        # a fresh address whose identifier nobody on the ring has, None once the ring is full
+        while len(self.nodes) < SIZE:
+            i = self.created
+            self.created += 1
+
+            address = self.address(i)
+            if address.identifier not in self.nodes:
+                node = Local(address, bootstrap)
+                self.nodes[address.identifier] = node
+                insort(self.identifiers, address.identifier)
+                self.listen(node)
+
+                return node
+
+        return None
+
+    def address(self, i):
+        return Address(f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}', 9000)
+
+    def listen(self, node):
+        loopback.register(node)
+
+    def close(self, node):
+        loopback.unregister(node.address)
+
+    def owner(self, identifier):
+        # the live node a correct lookup of identifier returns
+        index = bisect_left(self.identifiers, identifier % SIZE)
+
+        return self.nodes[self.identifiers[index % len(self.identifiers)]]
+
+    def room(self, count):
+        # a ring of SIZE identifiers can't hold more nodes than that
+        if len(self.nodes) + count > SIZE:
+            raise ValueError(f'{count} more nodes do not fit a ring of {SIZE} identifiers, raise --logsize')
+
+    def build(self, count):
+        # Wire a converged ring directly, every table as stabilize and
+        # fix_fingers would eventually leave it
+        self.room(count)
+        for _ in range(count):
+            self.new_node()
+
+        for node in self.nodes.values():
+            self.wire(node)
+            # don't let every node run its rounds in lockstep
+            IOLoop.current().call_later(self.random.uniform(0, 1), node.start_daemons)
+
+    def wire(self, node):
+        def remote(other):
+            return node if other is node else get_remote(other.address)
+
+        index = bisect_left(self.identifiers, node.identifier())
+        successors = [self.nodes[self.identifiers[(index + i) % len(self.identifiers)]]
+                      for i in range(1, NUMBER_OF_SUCCESSORS + 1)]
+
+        node.predecessor = remote(self.nodes[self.identifiers[index - 1]])
+        node.successors = [remote(other) for other in successors]
+        for i in range(LOGSIZE):
+            node.finger[i] = remote(self.owner(node.identifier(1 << i)))
+
+    async def grow(self, count):
+        # let the nodes join one after the other through the first one
+        self.room(count)
+        first = self.new_node()
+        await first.join()
+
+        for _ in range(count - 1):
+            await self.join(first)
+
+    async def join(self, bootstrap):
+        node = self.new_node(bootstrap.address)
+        if node is None:
+            return None
+
+        try:
+            await node.join(bootstrap.address)
+        except ChordError as e:
+            logging.warning(f'node {node.identifier()} could not join: {e}')
+            self.kill(node)
+            return None
+
+        return node
+
+    async def leave(self, node):
+        # a graceful exit, the node hands its range over before it goes
+        await node.leave()
+        self.kill(node)
+
+    def kill(self, node):
+        node.stop()
+        self.close(node)
+        del self.nodes[node.identifier()]
+        del self.identifiers[bisect_left(self.identifiers, node.identifier())]
+
+    async def stop(self):
+        for node in self.nodes.values():
+            node.stop()
+
+        # let requests in flight run out, it costs no real time
+        await gen.sleep(REQUEST_DEADLINE)
+
+    async def churn(self, rate, duration):
+        # failures and joins as a poisson process, half of each
+        end = IOLoop.current().time() + duration
+        while rate:
+            delay = self.random.expovariate(rate)
+            if IOLoop.current().time() + delay >= end:
+                break
+
+            await gen.sleep(delay)
+
+            live = list(self.nodes.values())
+            if self.random.random() < 0.5 and len(live) > 1:
+                self.kill(self.random.choice(live))
+            else:
+                IOLoop.current().add_callback(self.join, self.random.choice(live))
+
+    async def check(self, lookups):
+        # random lookups from random nodes, all at once, against the true owners
+        live = list(self.nodes.values())
+        keys = [self.random.randrange(SIZE) for _ in range(lookups)]
+        nodes = [self.random.choice(live) for _ in range(lookups)]
+
+        async def lookup(node, key):
+            started = IOLoop.current().time()
+            try:
+                owner = await node.find_successor(key)
+            except ChordError:
+                owner = None
+
+            return owner, IOLoop.current().time() - started
+
+        results = await gen.multi([lookup(node, key) for node, key in zip(nodes, keys)])
+        latencies = sorted(latency for _, latency in results)
+
+        correct = sum(1 for key, (owner, _) in zip(keys, results)
+                      if owner is not None and owner.identifier() == self.owner(key).identifier())
+
+        return {
+            'lookups': lookups,
+            'correct': correct / lookups if lookups else 1,
+            'latency_mean': sum(latencies) / lookups if lookups else 0,
+            'latency_p99': latencies[int(0.99 * (lookups - 1))] if lookups else 0,
+        }
+
+
+async def simulate():
+    simulator = Simulator(options.sim_latency, options.sim_jitter, options.sim_seed)
+    if options.sim_build == 'join':
+        await simulator.grow(options.sim_nodes)
+    else:
+        simulator.build(options.sim_nodes)
+
+    started = IOLoop.current().time()
+    before = sum(loopback.delivered.values())
+    await gen.multi([simulator.churn(options.sim_churn, options.sim_duration), gen.sleep(options.sim_duration)])
+    messages = sum(loopback.delivered.values()) - before
+
+    report = {
+        'nodes': len(simulator.nodes),
+        'logsize': LOGSIZE,
+        'virtual_seconds': IOLoop.current().time() - started,
+        'messages_per_node_second': messages / len(simulator.nodes) / options.sim_duration,
+    }
+    report.update(await simulator.check(options.sim_lookups))
+    print(json.dumps(report))
+
+    await simulator.stop()
+
+
+def main():
+    # per node info logs would drown the report
+    logging.getLogger().setLevel(logging.WARNING)
+
+    asyncio.set_event_loop(VirtualTimeLoop())
+    VirtualTimeIOLoop(make_current=True).run_sync(simulate)
+
+
+if __name__ == "__main__":
+    main()
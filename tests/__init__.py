@@ -0,0 +1,5 @@
+import os
+
+# simulator tests build rings of thousands of nodes, the default LOGSIZE
+# leaves room for 8
+os.environ.setdefault('CHORD_LOGSIZE', '32')
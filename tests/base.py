@@ -0,0 +1,34 @@
+import asyncio
+import unittest
+
+from tornado.options import options
+
+from core.failure_detector import failure_detector
+from core.transport import loopback
+from simulator import Simulator, VirtualTimeIOLoop, VirtualTimeLoop
+
+
+class SimulatorTestCase(unittest.TestCase):
+    """Runs every test on a virtual time event loop with a ring simulator of its own."""
+    latency = 0.01
+    jitter = 0.005
+    seed = None
+    # options a test may change, they are restored after it
+    saved_options = ()
+
+    def setUp(self):
+        self.options = {name: getattr(options, name) for name in ('transport',) + self.saved_options}
+        self.loop = VirtualTimeLoop()
+        asyncio.set_event_loop(self.loop)
+        self.io_loop = VirtualTimeIOLoop(make_current=True)
+        self.simulator = Simulator(latency=self.latency, jitter=self.jitter, seed=self.seed)
+
+    def tearDown(self):
+        self.io_loop.run_sync(self.simulator.stop)
+
+        loopback.nodes.clear()
+        failure_detector.peers.clear()
+        for name, value in self.options.items():
+            setattr(options, name, value)
+        self.io_loop.close(all_fds=True)
+        asyncio.set_event_loop(None)
@@ -3,6 +3,22 @@ import unittest
 
 TEST_MODULES = [
    'test_key_lookup',
+   'test_finger_table',
+   'test_simulator',
+   'test_metrics',
+   'test_tracing',
+   'test_replication',
+   'test_anti_entropy',
+   'test_handoff',
+   'test_log_store',
+   'test_key_routing',
+   'test_stream',
+   'test_peers',
+   'test_retry',
+   'test_single_flight',
+   'test_lookup_cache',
+   'test_batch_lookup',
+   'test_coalescing',
 ]
 
 
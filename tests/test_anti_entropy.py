@@ -0,0 +1,98 @@
+import random
+import unittest
+from unittest import mock
+
+from tornado import gen
+
+from core.metrics import SYNC_TRANSFERS
+from core.storage import MemoryStore, entry_hash
+from core.utils import hash_key, is_in_range
+from settings import SIZE
+from tests.base import SimulatorTestCase
+
+
+class HashTreeTestCase(unittest.TestCase):
+    def test_digest_covers_the_copies_in_range(self):
+        """A range's digest is the hash of exactly the copies in it"""
+        rng = random.Random(11)
+        store = MemoryStore()
+        for i in range(300):
+            store.put(f'key{rng.randrange(100)}', i, (i, 0))
+
+        for _ in range(50):
+            start, end = rng.randrange(SIZE), rng.randrange(SIZE)
+            expected = 0
+            for identifier, bucket in store.data.items():
+                if start == end or is_in_range(identifier, start, end):
+                    for key, (_, version) in bucket.items():
+                        expected ^= entry_hash(key, version)
+
+            self.assertEqual(store.digests(start, end, 0, [0]), [expected])
+
+    def test_digest_ignores_write_order(self):
+        """Stores holding the same copies agree whatever order they got them in"""
+        writes = [(f'key{i % 7}', i, (i, 1)) for i in range(30)]
+        first, second = MemoryStore(), MemoryStore()
+        for key, value, version in writes:
+            first.put(key, value, version)
+        for key, value, version in reversed(writes):
+            second.put(key, value, version)
+
+        self.assertEqual(first.tree.levels, second.tree.levels)
+
+
+class AntiEntropyTestCase(SimulatorTestCase):
+    seed = 9
+
+    def test_replica_that_lost_its_data_catches_up(self):
+        """Sync hands a wiped replica back only the copies it lost"""
+        async def run():
+            self.simulator.build(8)
+            await gen.sleep(5)
+
+            node = next(iter(self.simulator.nodes.values()))
+            for i in range(100):
+                await node.put(f'key{i}', i)
+
+            owner = self.simulator.owner(hash_key('key0'))
+            replica = self.simulator.nodes[owner.successors[0].identifier()]
+            lost = len(replica.store)
+            replica.store = MemoryStore()
+
+            before = sum(SYNC_TRANSFERS.snapshot().values())
+            await gen.sleep(300)
+
+            return lost, len(replica.store), sum(SYNC_TRANSFERS.snapshot().values()) - before
+
+        lost, recovered, transferred = self.io_loop.run_sync(run)
+        self.assertEqual(recovered, lost)
+        self.assertEqual(transferred, lost)
+
+    def test_tombstones_are_purged_after_the_grace_period(self):
+        """Replicas forget old deletes, and sync doesn't bring them or their keys back"""
+        async def run():
+            self.simulator.build(8)
+            await gen.sleep(5)
+
+            node = next(iter(self.simulator.nodes.values()))
+            for i in range(20):
+                await node.put(f'key{i}', i)
+            for i in range(10):
+                await node.delete(f'key{i}')
+
+            tombstones = sum(len(other.store.tombstones) for other in self.simulator.nodes.values())
+            await gen.sleep(300)
+
+            return (tombstones, sum(len(other.store.tombstones) for other in self.simulator.nodes.values()),
+                    [await node.get(f'key{i}') for i in range(20)])
+
+        with mock.patch('core.local.TOMBSTONE_GRACE', 60):
+            before, after, values = self.io_loop.run_sync(run)
+
+        self.assertGreater(before, 0)
+        self.assertEqual(after, 0)
+        self.assertEqual(values, [None] * 10 + list(range(10, 20)))
+
+
+if __name__ == '__main__':
+    unittest.main()
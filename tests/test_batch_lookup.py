@@ -0,0 +1,96 @@
+import unittest
+from collections import Counter
+
+from tornado import gen
+
+from core.remote import get_remote
+from core.transport import loopback
+from core.utils import CommandType
+from settings import LOOKUP_CACHE_TTL, SIZE
+from tests.base import SimulatorTestCase
+
+
+class BatchLookupTestCase(SimulatorTestCase):
+    seed = 17
+
+    def identifiers(self):
+        # random keys, node identifiers and their neighbours, both ends of
+        # the ring and repeats, in no particular order
+        nodes = list(self.simulator.nodes)
+        identifiers = [self.simulator.random.randrange(SIZE) for _ in range(20)]
+        identifiers += nodes[:3] + [(identifier + 1) % SIZE for identifier in nodes[:3]]
+        identifiers += [0, SIZE - 1] + identifiers[:5]
+        self.simulator.random.shuffle(identifiers)
+
+        return identifiers
+
+    def test_batch_answers_match_single_lookups(self):
+        """Every answer of a batch is what a lookup of that identifier alone returns"""
+        async def run():
+            self.simulator.build(12)
+            await gen.sleep(5)
+
+            mismatches = []
+            for node in self.simulator.nodes.values():
+                identifiers = self.identifiers()
+                batch = await node.find_successors(identifiers)
+                single = [await node.find_successor(identifier) for identifier in identifiers]
+
+                for identifier, found, alone in zip(identifiers, batch, single):
+                    expected = self.simulator.owner(identifier).identifier()
+                    if (found.identifier(), alone.identifier()) != (expected, expected):
+                        mismatches.append((node.identifier(), identifier))
+
+            return mismatches
+
+        self.assertEqual(self.io_loop.run_sync(run), [])
+
+    def test_batch_over_the_wire_keeps_the_order(self):
+        """A batch sent to a peer comes back in the order it was asked, cold caches or not"""
+        async def run():
+            self.simulator.build(12)
+            await gen.sleep(5)
+
+            node = next(iter(self.simulator.nodes.values()))
+            identifiers = self.identifiers()
+            found = await get_remote(node.address).find_successors(identifiers)
+
+            return ([owner.identifier() for owner in found],
+                    [self.simulator.owner(identifier).identifier() for identifier in identifiers],
+                    await node.find_successors([]))
+
+        found, expected, empty = self.io_loop.run_sync(run)
+        self.assertEqual(found, expected)
+        self.assertEqual(empty, [])
+
+    def test_cached_lookups_are_trusted_until_they_expire(self):
+        """Repeated lookups cost no message within the cache ttl, past it one hop to confirm each entry"""
+        async def run():
+            self.simulator.build(8)
+            await gen.sleep(5)
+            await self.simulator.stop()
+
+            node = next(iter(self.simulator.nodes.values()))
+            identifiers = self.identifiers()
+            for identifier in identifiers:
+                await node.find_successor(identifier)
+
+            delivered = []
+            for delay in (10, LOOKUP_CACHE_TTL):
+                await gen.sleep(delay)
+                before = Counter(loopback.delivered)
+                found = [await node.find_successor(identifier) for identifier in identifiers]
+                delivered.append(Counter(loopback.delivered) - before)
+
+            return delivered, [owner.identifier() for owner in found], \
+                [self.simulator.owner(identifier).identifier() for identifier in identifiers], len(node.lookup_cache)
+
+        (trusted, expired), found, expected, entries = self.io_loop.run_sync(run)
+        self.assertEqual(trusted, Counter())
+        self.assertEqual(set(expired), {CommandType.GET_PREDECESSOR})
+        self.assertLessEqual(expired[CommandType.GET_PREDECESSOR], entries)
+        self.assertEqual(found, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
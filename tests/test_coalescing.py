@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+from copy import deepcopy
+from unittest import mock
+
+from tornado import gen
+
+from core.address import Address
+from core.dispatch import dispatch
+from core.exceptions import HTTPConnection, RemoteError
+from core.metrics import INBOUND_ERRORS, INBOUND_LATENCY, INBOUND_REQUESTS
+from core.remote import DEFAULT_RETRY_POLICY, RETRY_POLICIES, Remote, get_remote
+from core.utils import CommandType
+from tests.base import SimulatorTestCase
+
+
+class CoalescingTestCase(SimulatorTestCase):
+    seed = 19
+
+    def test_crashing_sub_command_spares_its_siblings(self):
+        """A sub-command failing with any error fails alone, the rest of its batch is served"""
+        async def run():
+            self.simulator.build(3)
+            node = next(iter(self.simulator.nodes.values()))
+            remote = get_remote(node.address)
+
+            def crash(key):
+                raise ValueError(key)
+
+            with mock.patch.object(node, 'replica_get', crash), \
+                    mock.patch.object(node, 'execute_batch', wraps=node.execute_batch) as execute_batch, \
+                    self.assertLogs('play.core.dispatch', 'ERROR'):
+                results = await asyncio.gather(remote.replica_put('key', 'value', (1, 1)), remote.replica_get('key'),
+                                               return_exceptions=True)
+
+            return execute_batch.call_count, results, await node.replica_get('key')
+
+        batches, (put, get), stored = self.io_loop.run_sync(run)
+        self.assertEqual(batches, 1)
+        self.assertNotIsInstance(put, Exception)
+        self.assertIsInstance(get, RemoteError)
+        self.assertIn('ValueError', str(get))
+        self.assertEqual(stored, ('value', (1, 1)))
+
+    def test_sub_commands_are_counted_and_timed(self):
+        """Each member of a batch is counted, timed and its failure recorded, like a command of its own"""
+        node = self.simulator.new_node()
+        batch = {'cmd': CommandType.BATCH, 'data': {'commands': [
+            {'cmd': CommandType.REPLICA_PUT, 'data': {'key': 'key', 'value': 'value', 'version': (1, 1)}},
+            {'cmd': CommandType.REPLICA_GET, 'data': {'key': 'key'}},
+        ]}}
+        metrics = (INBOUND_REQUESTS, INBOUND_ERRORS, INBOUND_LATENCY)
+        before = [{labels: deepcopy(value) for labels, value in metric.snapshot().items()} for metric in metrics]
+
+        def crash(key):
+            raise ValueError(key)
+
+        with mock.patch.object(node, 'replica_get', crash), self.assertLogs('play.core.dispatch', 'ERROR'):
+            self.io_loop.run_sync(lambda: dispatch(node, batch))
+
+        requests, errors, latency = [metric.snapshot() for metric in metrics]
+        for cmd in (CommandType.BATCH, CommandType.REPLICA_PUT, CommandType.REPLICA_GET):
+            self.assertEqual(requests[(cmd,)] - before[0].get((cmd,), 0), 1)
+            observed = before[2].get((cmd,), [[0], 0])
+            self.assertEqual(sum(latency[(cmd,)][0]) - sum(observed[0]), 1)
+
+        failed = (CommandType.REPLICA_GET, 'ValueError')
+        self.assertEqual(errors[failed] - before[1].get(failed, 0), 1)
+        self.assertNotIn((CommandType.REPLICA_PUT, 'ValueError'), errors)
+
+    def test_batches_retry_with_their_members_policy(self):
+        """Commands are batched with the ones retried alike, routed commands go out alone"""
+        remote = Remote(Address('10.255.0.1', 9000))
+        sent = []
+
+        async def request(msg):
+            if msg['cmd'] == CommandType.BATCH:
+                sent.append(tuple(command['cmd'] for command in msg['data']['commands']))
+            else:
+                sent.append(msg['cmd'])
+            raise HTTPConnection('down')
+
+        async def run():
+            with mock.patch.object(remote, 'request', request):
+                await gen.multi([remote.replica_put('key', 'value', (1, 1)), remote.replica_get('key'),
+                                 remote.get_successors(), remote.get_predecessor(), remote.find_successor(5)],
+                                quiet_exceptions=HTTPConnection)
+
+        with self.assertRaises(HTTPConnection):
+            self.io_loop.run_sync(run)
+        # let every batch run out of attempts
+        self.io_loop.run_sync(lambda: gen.sleep(10))
+
+        replicas, default = RETRY_POLICIES[CommandType.REPLICA_PUT].attempts, DEFAULT_RETRY_POLICY.attempts
+        self.assertEqual(sorted(map(str, sent)), sorted(map(str, (
+            [(CommandType.REPLICA_PUT, CommandType.REPLICA_GET)] * replicas +
+            [(CommandType.GET_SUCCESSORS, CommandType.GET_PREDECESSOR)] * default +
+            [CommandType.FIND_SUCCESSOR] * default))))
+
+
+if __name__ == '__main__':
+    unittest.main()
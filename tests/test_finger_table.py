@@ -0,0 +1,73 @@
+import unittest
+
+from core.finger import FingerTable
+from settings import LOGSIZE, SIZE
+
+
+class FakeNode:
+    def __init__(self, identifier):
+        self.address = identifier
+
+    def identifier(self, offset=0):
+        return (self.address + offset) % SIZE
+
+    def __repr__(self):
+        return f'FakeNode({self.address})'
+
+
+class FingerTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.owner = FakeNode(0)
+        self.table = FingerTable(self.owner)
+
+    def test_alone_in_the_ring(self):
+        """Every finger points back at the owner when it is alone"""
+        self.table[0] = self.owner
+
+        self.assertEqual(list(self.table), [self.owner] * LOGSIZE)
+        self.assertEqual(self.table.preceding(SIZE // 2), [])
+        self.assertEqual(self.table.refresh_indices(), [1])
+
+    def test_fingers_share_intervals(self):
+        """Fingers pointing at the same node collapse into one entry"""
+        last = FakeNode(SIZE - 1)
+        self.table[0] = last
+
+        self.assertEqual(list(self.table), [last] * LOGSIZE)
+        self.assertEqual(self.table.nodes(), [last])
+        self.assertEqual(self.table.refresh_indices(), [1])
+
+    def test_setting_a_finger_drops_skipped_nodes(self):
+        """A successor answer removes the nodes it proves to be gone"""
+        near, middle, far = FakeNode(1), FakeNode(SIZE // 2), FakeNode(SIZE - 1)
+        self.table[0] = near
+        self.table[LOGSIZE - 1] = middle
+        self.table[LOGSIZE - 1] = far
+
+        self.assertEqual(self.table.nodes(), [near, far])
+        self.assertEqual(self.table[LOGSIZE - 1], far)
+
+    def test_preceding_is_closest_first(self):
+        """Closest preceding candidates come in decreasing distance"""
+        nodes = [FakeNode(1 << i) for i in range(LOGSIZE)]
+        for i, node in enumerate(nodes):
+            self.table[i] = node
+
+        self.assertEqual(self.table.preceding(SIZE - 1), list(reversed(nodes)))
+        self.assertEqual(self.table.preceding(1), [])
+
+        self.table.remove(nodes[-1])
+        self.assertEqual(self.table.preceding(SIZE - 1), list(reversed(nodes[:-1])))
+
+    def test_seed_keeps_known_nodes(self):
+        """Seeded candidates are added next to verified fingers, once each"""
+        near, middle, far = FakeNode(1), FakeNode(SIZE // 2), FakeNode(SIZE - 1)
+        self.table[0] = middle
+        self.table.seed([far, near, middle, self.owner])
+
+        self.assertEqual(self.table.nodes(), [near, middle, far])
+        self.assertEqual(self.table.refresh_indices(), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import random
+import unittest
+from unittest import mock
+
+from tornado import gen
+from tornado.options import options
+
+from core import local
+from core.failure_detector import failure_detector
+from core.remote import get_remote
+from core.storage import MemoryStore
+from core.utils import hash_key, is_in_range
+from settings import SIZE, SUSPECT_AFTER_FAILURES
+from tests.base import SimulatorTestCase
+
+
+class HandoffTestCase(SimulatorTestCase):
+    seed = 13
+    saved_options = ('replicas', 'write_quorum', 'read_quorum')
+
+    def setUp(self):
+        super().setUp()
+        # a single copy of every key, only handoffs can move it
+        options.replicas = options.write_quorum = options.read_quorum = 1
+        # small chunks, so handing a range over takes several of them
+        self.chunk_size = mock.patch.object(local, 'TRANSFER_CHUNK_SIZE', 4)
+        self.chunk_size.start()
+
+    def tearDown(self):
+        super().tearDown()
+        self.chunk_size.stop()
+
+    def owners_hold(self, keys):
+        return all(self.simulator.owner(hash_key(key)).store.get(key) == value for key, value in keys.items())
+
+    def test_joining_node_takes_its_keys(self):
+        """Keys move to a node that joins in front of their owner"""
+        async def run():
+            self.simulator.build(4)
+            await gen.sleep(5)
+
+            keys = {f'key{i}': i for i in range(50)}
+            first = next(iter(self.simulator.nodes.values()))
+            for key, value in keys.items():
+                await first.put(key, value)
+
+            for _ in range(3):
+                await self.simulator.join(first)
+            await gen.sleep(30)
+
+            return self.owners_hold(keys)
+
+        self.assertTrue(self.io_loop.run_sync(run))
+
+    def test_leaving_node_hands_over_its_keys(self):
+        """Keys of a node that leaves end up on its successor"""
+        async def run():
+            self.simulator.build(6)
+            await gen.sleep(5)
+
+            keys = {f'key{i}': i for i in range(50)}
+            nodes = list(self.simulator.nodes.values())
+            for key, value in keys.items():
+                await nodes[0].put(key, value)
+
+            await self.simulator.leave(nodes[1])
+            await self.simulator.leave(nodes[2])
+            await gen.sleep(10)
+
+            return self.owners_hold(keys), [await nodes[0].get(key) for key in keys]
+
+        held, values = self.io_loop.run_sync(run)
+        self.assertTrue(held)
+        self.assertEqual(values, list(range(50)))
+
+    def test_handoffs_to_departed_nodes_are_dropped(self):
+        """Handoffs to a node that left or that is suspected are given up, the others kept"""
+        node, left, failed, alive = [self.simulator.new_node() for _ in range(4)]
+        for other in (left, failed, alive):
+            node.handoffs[get_remote(other.address), 0, SIZE // 2] = None
+
+        # not joined yet, it has no successor for the leaving node to be
+        self.io_loop.run_sync(lambda: node.leaving(get_remote(left.address), None, []))
+        self.assertIsNone(node.finger[0])
+        self.assertFalse(failure_detector.is_alive(left.address))
+
+        for _ in range(SUSPECT_AFTER_FAILURES):
+            failure_detector.failed(failed.address)
+        node.topology_changed()
+
+        self.assertEqual([handoff[0].address for handoff in node.handoffs], [alive.address])
+
+    def test_walk_resumes_after_a_cursor(self):
+        """A range is walked in ring order and picks up after the last identifier sent"""
+        rng = random.Random(17)
+        store = MemoryStore()
+        for i in range(200):
+            store.put(f'key{i}', i, (i, 0))
+
+        start, end = rng.randrange(SIZE), rng.randrange(SIZE)
+        inside = [identifier for identifier in store.data if start == end or is_in_range(identifier, start, end)]
+        expected = sorted(inside, key=lambda identifier: (identifier - start) % SIZE)
+
+        self.assertEqual(list(store.tree.walk(start, end)), expected)
+        if expected:
+            self.assertEqual(list(store.tree.walk(start, end, expected[len(expected) // 2])),
+                             expected[len(expected) // 2 + 1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from collections import Counter
+
+from tornado import gen
+from tornado.options import options
+
+from core.transport import loopback
+from core.utils import CommandType, hash_key
+from tests.base import SimulatorTestCase
+
+
+class KeyRoutingTestCase(SimulatorTestCase):
+    seed = 21
+    saved_options = ('replicas', 'write_quorum', 'read_quorum')
+
+    def setUp(self):
+        super().setUp()
+        # a single copy of every key, so it is plain which node served it
+        options.replicas = options.write_quorum = options.read_quorum = 1
+
+    async def quiet_ring(self, count):
+        # a converged ring without daemons, every message sent belongs to the test
+        self.simulator.build(count)
+        await gen.sleep(5)
+        await self.simulator.stop()
+
+        return list(self.simulator.nodes.values())
+
+    def test_any_node_serves_put_get_and_delete(self):
+        """Operations sent to any node land on the owner of the key"""
+        async def run():
+            nodes = await self.quiet_ring(16)
+            for i in range(30):
+                await self.simulator.random.choice(nodes).put(f'key{i}', i)
+
+            values = [await self.simulator.random.choice(nodes).get(f'key{i}') for i in range(30)]
+            held = all(self.simulator.owner(hash_key(f'key{i}')).store.get(f'key{i}') == i for i in range(30))
+            deleted = [await nodes[0].delete('key0'), await nodes[0].delete('missing')]
+
+            return values, held, deleted, await nodes[-1].get('key0')
+
+        values, held, deleted, value = self.io_loop.run_sync(run)
+        self.assertEqual(values, list(range(30)))
+        self.assertTrue(held)
+        self.assertEqual(deleted, [True, False])
+        self.assertIsNone(value)
+
+    def test_operation_is_forwarded_without_lookups(self):
+        """A put travels to the owner itself, nobody is asked for the owner first"""
+        async def run():
+            nodes = await self.quiet_ring(16)
+            before = Counter(loopback.delivered)
+            await nodes[0].put('key', 'value')
+
+            return Counter(loopback.delivered) - before
+
+        delivered = self.io_loop.run_sync(run)
+        self.assertEqual(set(delivered) - {CommandType.PUT, CommandType.REPLICA_PUT, CommandType.GET_SUCCESSOR}, set())
+        self.assertLessEqual(delivered[CommandType.PUT], 8)
+
+    def test_disagreeing_nodes_settle_on_one_owner(self):
+        """A node told it owns a key that belongs to its predecessor passes it back once, no further"""
+        async def run():
+            nodes = await self.quiet_ring(8)
+            owner = self.simulator.owner(hash_key('key'))
+            before = self.simulator.nodes[owner.predecessor.identifier()]
+            after = self.simulator.nodes[owner.successors[0].identifier()]
+            # the node before the owner missed it joining, it still takes
+            # the next one for its successor
+            before.successors = before.successors[1:]
+            before.finger[0] = before.successors[0]
+
+            sent = Counter(loopback.delivered)
+            await nodes[0].put('key', 'value')
+            delivered = Counter(loopback.delivered) - sent
+
+            return delivered[CommandType.PUT], owner.store.get('key'), after.store.get('key')
+
+        puts, mine, theirs = self.io_loop.run_sync(run)
+        self.assertLessEqual(puts, 8)
+        self.assertEqual((mine, theirs), ('value', None))
+
+    def test_nodes_without_predecessors_still_route(self):
+        """Routing only needs successors and fingers to reach some node"""
+        async def run():
+            nodes = await self.quiet_ring(8)
+            for node in nodes:
+                node.predecessor = None
+
+            await nodes[0].put('key', 'value')
+            return await nodes[-1].get('key')
+
+        self.assertEqual(self.io_loop.run_sync(run), 'value')
+
+
+if __name__ == '__main__':
+    unittest.main()
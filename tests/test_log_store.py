@@ -0,0 +1,143 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from core.storage import LogStore, MemoryStore
+
+
+class LogStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=True)
+        self.path = tempfile.mkdtemp(prefix='127.0.0.1-')
+
+    def tearDown(self):
+        self.io_loop.close(all_fds=True)
+        shutil.rmtree(self.path)
+
+    def write(self, stores, first, last):
+        for i in range(first, last):
+            for store in stores:
+                if i % 7 == 3:
+                    store.delete(f'key{i // 2}', (i, 0))
+                else:
+                    store.put(f'key{i // 2}', i, (i, 0))
+
+    def assertSameCopies(self, store, expected):
+        self.assertEqual(store.tree.levels, expected.tree.levels)
+        self.assertEqual(len(store), len(expected))
+        for identifier in expected.data:
+            self.assertEqual(store.copies(identifier), expected.copies(identifier))
+
+    def test_reopened_store_has_every_copy(self):
+        """Copies in the compacted base and in the tail survive a restart"""
+        expected = MemoryStore()
+        store = LogStore(self.path, compaction_bytes=1 << 30)
+        self.write([store, expected], 0, 300)
+        self.io_loop.run_sync(store.compact)
+        self.write([store, expected], 300, 400)
+        store.close()
+
+        store = LogStore(self.path)
+        self.assertSameCopies(store, expected)
+        store.close()
+
+    def test_compaction_leaves_one_base(self):
+        """A compaction replaces the base and the tails it merged"""
+        store = LogStore(self.path, compaction_bytes=1 << 30)
+        for round in range(3):
+            self.write([store], round * 100, (round + 1) * 100)
+            self.io_loop.run_sync(store.compact)
+
+        names = sorted(os.path.basename(name) for name in glob.glob(os.path.join(self.path, '*')))
+        self.assertEqual(names, ['base-00000003.data', 'base-00000003.index', 'tail-00000004.log'])
+
+        identifiers = [store.base.identifier(i) for i in range(store.base.count)]
+        self.assertEqual(identifiers, sorted(identifiers))
+        store.close()
+
+    def test_purged_tombstones_leave_with_compaction(self):
+        """Purged tombstones are gone at once, and from the files with the next compaction"""
+        expected = MemoryStore()
+        store = LogStore(self.path, compaction_bytes=1 << 30)
+        self.write([store, expected], 0, 300)
+        self.io_loop.run_sync(store.compact)
+        self.write([store, expected], 300, 400)
+
+        purged = store.purge(350)
+        self.assertGreater(purged, 0)
+        self.assertEqual(purged, expected.purge(350))
+        self.assertSameCopies(store, expected)
+        self.assertEqual(store.tree.identifiers, expected.tree.identifiers)
+
+        self.io_loop.run_sync(store.compact)
+        tombstones = [store.base.entry(i) for i in range(store.base.count) if not store.base.entry(i)[4]]
+        self.assertEqual(len(tombstones), len(expected.tombstones))
+        self.assertEqual(store.purged, {})
+        store.close()
+
+        store = LogStore(self.path)
+        self.assertSameCopies(store, expected)
+        self.assertEqual(store.tombstones, expected.tombstones)
+        store.close()
+
+    def test_torn_record_is_dropped(self):
+        """A record cut short by a crash is skipped, the ones before it kept"""
+        store = LogStore(self.path)
+        store.put('first', 1, (1, 0))
+        store.put('second', 2, (2, 0))
+        store.close()
+
+        tail = glob.glob(os.path.join(self.path, 'tail-*.log'))[0]
+        with open(tail, 'r+b') as f:
+            f.truncate(os.path.getsize(tail) - 3)
+
+        store = LogStore(self.path)
+        self.assertEqual(store.get('first'), 1)
+        self.assertIsNone(store.get('second'))
+        store.close()
+
+    def test_writes_of_a_tick_share_an_fsync(self):
+        """Writes made together are on disk after one fsync, durable waits for it"""
+        store = LogStore(self.path)
+
+        async def run():
+            for i in range(3):
+                store.put(f'key{i}', i, (i, 0))
+            await store.durable()
+
+        with mock.patch('core.storage.os.fsync', wraps=os.fsync) as fsync:
+            self.io_loop.run_sync(run)
+            self.io_loop.run_sync(store.durable)
+
+        self.assertEqual(fsync.call_count, 1)
+        store.close()
+
+    def test_idle_store_compacts_in_time(self):
+        """A store whose tail never fills compacts once the interval passed, purged tombstones leave the files"""
+        store = LogStore(self.path, compaction_bytes=1 << 30, compaction_interval=60)
+        self.write([store], 0, 100)
+        started = self.io_loop.time()
+
+        async def purge(at):
+            self.io_loop.time = lambda: at
+            store.purge(50)
+            await gen.sleep(0)
+            while store.compacting:
+                await gen.sleep(0.01)
+
+            return sorted(os.path.basename(name) for name in glob.glob(os.path.join(self.path, 'base-*')))
+
+        self.assertEqual(self.io_loop.run_sync(lambda: purge(started + 30)), [])
+        self.assertEqual(len(self.io_loop.run_sync(lambda: purge(started + 61))), 2)
+        self.assertEqual(store.purged, {})
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
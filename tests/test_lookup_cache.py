@@ -0,0 +1,93 @@
+import unittest
+from types import SimpleNamespace
+
+from tornado.ioloop import IOLoop
+
+from core.cache import LookupCache
+from settings import SIZE
+
+
+class FakeNode:
+    def __init__(self, identifier):
+        self.address = SimpleNamespace(identifier=identifier % SIZE)
+
+    def identifier(self, offset=0):
+        return (self.address.identifier + offset) % SIZE
+
+
+class LookupCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=True)
+        self.cache = LookupCache(capacity=16, ttl=30)
+
+    def tearDown(self):
+        self.io_loop.close(all_fds=True)
+
+    def owner(self, identifier):
+        entry = self.cache.get(identifier)
+
+        return entry and entry[1].identifier()
+
+    def test_topology_change_turns_away_older_lookups(self):
+        """Answers of lookups started before a topology change are not cached"""
+        version = self.cache.version
+        self.cache.put(0, FakeNode(4), version)
+        self.cache.clear()
+        self.cache.put(4, FakeNode(6), version)
+
+        self.assertEqual((self.owner(3), self.owner(5)), (None, None))
+
+        self.cache.put(4, FakeNode(6), self.cache.version)
+        self.assertEqual(self.owner(5), 6)
+
+    def test_new_interval_drops_only_the_owners_inside_it(self):
+        """An owner cached inside a newer interval is dropped, its neighbours stay"""
+        for start, owner in ((0, 2), (2, 3), (3, 5), (5, SIZE - 1)):
+            self.cache.put(start, FakeNode(owner), self.cache.version)
+
+        # (1, 4] holds 2 and 3, which can't own anything any more
+        self.cache.put(1, FakeNode(4), self.cache.version)
+        self.assertEqual(self.cache.owners, [4, 5, SIZE - 1])
+
+        # around the top of the ring, (SIZE - 2, 5] holds SIZE - 1 and 4
+        self.cache.put(SIZE - 2, FakeNode(5), self.cache.version)
+        self.assertEqual(self.cache.owners, [5])
+        self.assertEqual(self.owner(0), 5)
+
+    def test_single_identifier_interval_keeps_the_rest(self):
+        """An interval holding nothing but its owner contradicts no other entry"""
+        self.cache.put(0, FakeNode(2), self.cache.version)
+        self.cache.put(4, FakeNode(5), self.cache.version)
+
+        self.assertEqual(self.cache.owners, [2, 5])
+
+    def test_new_owner_narrows_the_interval_it_joined(self):
+        """A node found inside a cached interval shortens that interval to start at it"""
+        self.cache.put(0, FakeNode(6), self.cache.version)
+        self.cache.put(1, FakeNode(3), self.cache.version)
+
+        self.assertEqual((self.owner(2), self.owner(3), self.owner(4), self.owner(6)), (3, 3, 6, 6))
+        self.assertEqual(self.cache.entries[6][0], 3)
+
+    def test_invalidate_drops_a_failed_owner(self):
+        """Entries of a peer that failed go, entries of others stay"""
+        failed, alive = FakeNode(4), FakeNode(6)
+        self.cache.put(0, failed, self.cache.version)
+        self.cache.put(4, alive, self.cache.version)
+
+        self.cache.invalidate(failed.address)
+        self.cache.invalidate(FakeNode(9).address)
+        self.assertEqual((self.owner(3), self.owner(5)), (None, 6))
+
+    def test_expired_entries_are_kept_for_confirming(self):
+        """An entry past the ttl is still found, marked expired"""
+        self.cache.put(0, FakeNode(4), self.cache.version)
+        entry = self.cache.get(3)
+        self.assertFalse(self.cache.expired(entry))
+
+        self.io_loop.time = lambda: entry[2] + 31
+        self.assertTrue(self.cache.expired(self.cache.get(3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from core.metrics import Registry
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_per_label(self):
+        """Counters keep one sample per label value"""
+        counter = self.registry.counter('test_requests_total', 'Requests.', ('command',))
+        counter.inc('PING')
+        counter.inc('PING')
+        counter.inc('GET', amount=3)
+
+        self.assertEqual(counter.snapshot(), {('PING',): 2, ('GET',): 3})
+        self.assertEqual(counter.render().splitlines(), [
+            '# HELP test_requests_total Requests.',
+            '# TYPE test_requests_total counter',
+            'test_requests_total{command="GET"} 3',
+            'test_requests_total{command="PING"} 2',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Bucket counts include every smaller bucket, bounds are inclusive"""
+        histogram = self.registry.histogram('test_hops', 'Hops.', buckets=(1, 2, 4))
+        for value in (0, 1, 2, 3, 9):
+            histogram.observe(value)
+
+        self.assertEqual(list(histogram.samples()), [
+            'test_hops_bucket{le="1"} 2',
+            'test_hops_bucket{le="2"} 3',
+            'test_hops_bucket{le="4"} 4',
+            'test_hops_bucket{le="+Inf"} 5',
+            'test_hops_sum 15',
+            'test_hops_count 5',
+        ])
+
+    def test_label_values_are_escaped(self):
+        """Quotes and backslashes in label values don't break the format"""
+        counter = self.registry.counter('test_errors_total', 'Errors.', ('error',))
+        counter.inc('say "hi"\\')
+
+        self.assertEqual(list(counter.samples()), ['test_errors_total{error="say \\"hi\\"\\\\"} 1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
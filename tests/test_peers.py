@@ -0,0 +1,131 @@
+import unittest
+from unittest import mock
+
+from tornado import gen
+from tornado.httpclient import HTTPClientError
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.options import options
+from tornado.testing import bind_unused_port
+
+from app import PlayStackTornado
+from core.address import Address
+from core.local import Local
+from core.peers import _registries, registry
+from core.remote import get_remote
+from core.stream import KeepAliveConnection
+from settings import MAX_CONNECTIONS_PER_PEER
+
+
+class CountingServer(HTTPServer):
+    # counts the connections it accepted
+    def initialize(self, *args, **kwargs):
+        super().initialize(*args, **kwargs)
+        self.accepted = 0
+
+    def handle_stream(self, stream, address):
+        self.accepted += 1
+        super().handle_stream(stream, address)
+
+
+class PeerPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.transport = options.transport
+        options.transport = 'http'
+        self.io_loop = IOLoop(make_current=True)
+
+        sock, port = bind_unused_port()
+        self.server = CountingServer(PlayStackTornado(node=Local(Address('127.0.0.1', port))))
+        self.server.add_sockets([sock])
+        self.remote = get_remote(Address('127.0.0.1', port))
+
+    def tearDown(self):
+        registry().pool(self.remote.address).close()
+        self.server.stop()
+        self.io_loop.run_sync(self.server.close_all_connections)
+
+        options.transport = self.transport
+        self.io_loop.close(all_fds=True)
+
+    def test_warm_connection_carries_later_rpcs(self):
+        """The connection warm_up opens serves every request sent after it"""
+        async def run():
+            await registry().warm_up([self.remote])
+            warmed = self.server.accepted
+
+            answers = [await self.remote.ping() for _ in range(5)]
+            await self.remote.get_predecessor()
+
+            return warmed, answers, self.server.accepted
+
+        self.assertEqual(self.io_loop.run_sync(run), (1, [True] * 5, 1))
+
+    def test_concurrent_rpcs_stay_within_the_limit(self):
+        """Concurrent requests open at most MAX_CONNECTIONS_PER_PEER connections and keep them"""
+        async def run():
+            first = await gen.multi([self.remote.ping() for _ in range(3 * MAX_CONNECTIONS_PER_PEER)])
+            second = await gen.multi([self.remote.ping() for _ in range(3 * MAX_CONNECTIONS_PER_PEER)])
+
+            return all(first + second), self.server.accepted
+
+        self.assertEqual(self.io_loop.run_sync(run), (True, MAX_CONNECTIONS_PER_PEER))
+
+    def test_connection_closed_by_the_peer_is_replaced(self):
+        """A request on a connection the peer dropped while idle goes out on a fresh one"""
+        async def run():
+            await self.remote.ping()
+            await self.server.close_all_connections()
+            # let the close reach our end
+            await gen.sleep(0.01)
+
+            return await self.remote.ping(), self.server.accepted
+
+        self.assertEqual(self.io_loop.run_sync(run), (True, 2))
+
+    def test_error_status_keeps_the_connection(self):
+        """A response with an error status was read in full, its connection carries the next request"""
+        pool = registry().pool(self.remote.address)
+
+        async def run():
+            with self.assertRaises(HTTPClientError):
+                await pool.fetch('/missing/', b'{}')
+            idle = len(pool.idle)
+
+            return idle, await self.remote.ping(), self.server.accepted
+
+        self.assertEqual(self.io_loop.run_sync(run), (1, True, 1))
+
+    def test_abandoned_request_closes_the_connection(self):
+        """A connection whose request failed halfway is closed rather than reused"""
+        pool = registry().pool(self.remote.address)
+
+        async def run():
+            await self.remote.ping()
+            connection = pool.idle[-1]
+            with mock.patch.object(KeepAliveConnection, 'request', side_effect=ValueError), \
+                    self.assertRaises(ValueError):
+                await pool.fetch('/chord/', b'{}')
+
+            return connection.closed(), pool.idle
+
+        self.assertEqual(self.io_loop.run_sync(run), (True, []))
+
+    def test_registries_of_closed_loops_are_dropped(self):
+        """A registry goes away once its event loop was closed"""
+        loops = [IOLoop(make_current=False) for _ in range(2)]
+
+        loops[0].make_current()
+        registry()
+        loops[0].close()
+
+        # the next loop to get a registry finds the closed one
+        loops[1].make_current()
+        registry()
+        loops[1].close()
+        self.io_loop.make_current()
+
+        self.assertNotIn(loops[0], _registries)
+
+
+if __name__ == '__main__':
+    unittest.main()
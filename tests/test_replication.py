@@ -0,0 +1,92 @@
+import unittest
+
+from tornado import gen
+from tornado.options import options
+
+from core.storage import MemoryStore
+from core.utils import hash_key
+from tests.base import SimulatorTestCase
+
+
+class ReplicationTestCase(SimulatorTestCase):
+    seed = 5
+    saved_options = ('read_quorum',)
+
+    def test_keys_survive_their_owner(self):
+        """Keys are still read after the node owning them fails"""
+        async def run():
+            self.simulator.build(8)
+            await gen.sleep(5)
+
+            nodes = list(self.simulator.nodes.values())
+            for i in range(20):
+                await self.simulator.random.choice(nodes).put(f'key{i}', i)
+
+            self.simulator.kill(self.simulator.owner(hash_key('key0')))
+            await gen.sleep(30)
+
+            node = next(iter(self.simulator.nodes.values()))
+            return [await node.get(f'key{i}') for i in range(20)]
+
+        self.assertEqual(self.io_loop.run_sync(run), list(range(20)))
+
+    def test_read_repairs_stale_replicas(self):
+        """A read brings replicas that missed a write up to date"""
+        async def run():
+            self.simulator.build(8)
+            await gen.sleep(5)
+
+            node = next(iter(self.simulator.nodes.values()))
+            await node.put('key', 'old')
+            await node.put('key', 'new')
+
+            owner = self.simulator.owner(hash_key('key'))
+            replicas = [self.simulator.nodes[replica.identifier()] for replica in owner.replicas()]
+            replicas[-1].store = MemoryStore()
+
+            options.read_quorum = len(replicas)
+            value = await node.get('key')
+            await gen.sleep(1)
+
+            return value, [replica.store.get('key') for replica in replicas]
+
+        value, copies = self.io_loop.run_sync(run)
+        self.assertEqual(value, 'new')
+        self.assertEqual(copies, ['new'] * len(copies))
+
+    def test_store_keeps_the_newest_copy(self):
+        """Older copies neither overwrite a key nor bring a deleted one back"""
+        store = MemoryStore()
+        store.put('key', 'new', (2, 0))
+        store.put('key', 'old', (1, 0))
+        self.assertEqual(store.get('key'), 'new')
+
+        self.assertTrue(store.delete('key', (3, 0)))
+        store.put('key', 'new', (2, 0))
+        self.assertIsNone(store.get('key'))
+        self.assertEqual(len(store), 0)
+
+    def test_purge_forgets_old_tombstones(self):
+        """Tombstones older than the horizon are forgotten and not taken back"""
+        store, expected = MemoryStore(), MemoryStore()
+        for target in (store, expected):
+            target.put('kept', 'value', (1, 0))
+            target.delete('recent', (20, 0))
+        store.put('old', 'value', (1, 0))
+        store.delete('old', (5, 0))
+        store.put('again', 'value', (8, 0))
+        store.delete('again', (6, 0))
+
+        self.assertEqual(store.purge(10), 1)
+        self.assertEqual(store.tombstones, {'recent': (20, 0)})
+        self.assertFalse(store.delete('old', (5, 0)))
+        store.put('again', 'value', (8, 0))
+        self.assertEqual(store.get_version('old'), (None, None))
+
+        expected.put('again', 'value', (8, 0))
+        self.assertEqual(store.tree.levels, expected.tree.levels)
+        self.assertEqual(store.tree.identifiers, expected.tree.identifiers)
+
+
+if __name__ == '__main__':
+    unittest.main()
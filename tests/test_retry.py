@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+
+from tornado import gen
+
+from core.address import Address
+from core.context import deadline_scope, time_left
+from core.exceptions import DeadlineExceeded, HTTPConnection
+from core.failure_detector import failure_detector
+from core.remote import DEFAULT_RETRY_POLICY, RETRY_POLICIES, Remote
+from core.utils import CommandType
+from settings import REQUEST_DEADLINE
+from tests.base import SimulatorTestCase
+
+
+class RetryTestCase(SimulatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.remote = Remote(Address('10.255.0.1', 9000))
+        self.sent = []
+
+    def request(self, *outcomes):
+        # stand in for the transport, every attempt takes the next outcome
+        outcomes = iter(outcomes)
+
+        async def request(msg):
+            self.sent.append(dict(msg))
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            if isinstance(outcome, (int, float)):
+                await gen.sleep(outcome)
+
+            return {'data': outcome}
+
+        return mock.patch.object(self.remote, 'request', request)
+
+    def test_attempts_follow_the_command_policy(self):
+        """A failing command is tried as often as its retry policy says, then fails"""
+        attempts = {}
+        for cmd in (CommandType.PING, CommandType.GET_PREDECESSOR, CommandType.REPLICA_PUT):
+            self.sent = []
+            with self.request(*[HTTPConnection('down')] * 5):
+                with self.assertRaises(HTTPConnection):
+                    self.io_loop.run_sync(lambda: self.remote.transmit({'cmd': cmd}))
+
+            attempts[cmd] = len(self.sent)
+
+        self.assertEqual(attempts, {
+            CommandType.PING: RETRY_POLICIES[CommandType.PING].attempts,
+            CommandType.GET_PREDECESSOR: DEFAULT_RETRY_POLICY.attempts,
+            CommandType.REPLICA_PUT: RETRY_POLICIES[CommandType.REPLICA_PUT].attempts,
+        })
+        self.assertEqual(attempts[CommandType.REPLICA_PUT], 3)
+
+    def test_retry_answers_after_a_failure(self):
+        """The answer to a retry is the answer to the call"""
+        with self.request(HTTPConnection('down'), 'answer'):
+            response = self.io_loop.run_sync(lambda: self.remote.transmit({'cmd': CommandType.GET_PREDECESSOR}))
+
+        self.assertEqual(response['data'], 'answer')
+        self.assertEqual(len(self.sent), 2)
+
+    def test_deadline_cuts_retries_short(self):
+        """Attempts share the deadline of the request being served and carry what is left of it"""
+        async def run():
+            started = self.io_loop.time()
+            with deadline_scope(5), self.assertRaises(DeadlineExceeded):
+                await self.remote.transmit({'cmd': CommandType.REPLICA_PUT})
+
+            return self.io_loop.time() - started
+
+        with self.request(100, 100, 100):
+            elapsed = self.io_loop.run_sync(run)
+
+        # the first attempt times out after RPC_TIMEOUT, the second runs
+        # into the deadline, the third is never made
+        self.assertAlmostEqual(elapsed, 5)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(self.sent[0]['time_left'], 5)
+        self.assertLess(self.sent[1]['time_left'], 2)
+        # only the attempt that used up its own timeout counts against the peer
+        self.assertEqual(failure_detector.peers[self.remote.address].failures, 1)
+
+    def test_lookups_start_with_a_deadline(self):
+        """A lookup started here runs under REQUEST_DEADLINE, one served for a peer keeps the deadline it came with"""
+        node = self.simulator.new_node()
+        budgets = []
+
+        async def cached_successor(identifier):
+            budgets.append(time_left())
+            return node
+
+        async def run():
+            await node.find_successor(1)
+            with deadline_scope(3):
+                await node.find_successor(2)
+
+        with mock.patch.object(node, 'cached_successor', cached_successor):
+            self.io_loop.run_sync(run)
+
+        self.assertEqual(budgets, [REQUEST_DEADLINE, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import logging
+import time
+import unittest
+from collections import Counter
+
+from tornado import gen
+
+from core.remote import get_remote
+from core.transport import loopback
+from core.utils import CommandType
+from tests.base import SimulatorTestCase
+
+
+class RingTestCase(SimulatorTestCase):
+    seed = 7
+
+    def test_converged_ring_survives_a_failure(self):
+        """Lookups find the true owners after a node fails"""
+        async def run():
+            self.simulator.build(16)
+            await gen.sleep(5)
+
+            self.simulator.kill(next(iter(self.simulator.nodes.values())))
+            await gen.sleep(30)
+
+            return await self.simulator.check(100)
+
+        report = self.io_loop.run_sync(run)
+        self.assertEqual(report['correct'], 1)
+
+    def test_nodes_join_one_by_one(self):
+        """A ring grown by joins converges within virtual seconds"""
+        async def run():
+            await self.simulator.grow(16)
+            await gen.sleep(30)
+
+            return await self.simulator.check(100)
+
+        report = self.io_loop.run_sync(run)
+        self.assertEqual(report['correct'], 1)
+        self.assertLess(self.io_loop.time(), 120)
+
+    def test_thousands_of_nodes_fit_one_loop(self):
+        """A ring of a few thousand nodes runs on one loop and its lookups find the true owners"""
+        # thousands of nodes log more than the test takes otherwise
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        started = time.monotonic()
+
+        async def run():
+            self.simulator.build(2000)
+            await gen.sleep(10)
+
+            return await self.simulator.check(100)
+
+        self.assertEqual(self.io_loop.run_sync(run)['correct'], 1)
+        self.assertLess(time.monotonic() - started, 120)
+
+    def test_quiet_ring_heartbeats_back_off(self):
+        """A ring where nobody fails sends few heartbeats, peers it talks to anyway get none"""
+        async def run():
+            self.simulator.build(6)
+            await gen.sleep(10)
+
+            before = Counter(loopback.delivered)
+            await gen.sleep(100)
+
+            return Counter(loopback.delivered) - before
+
+        delivered = self.io_loop.run_sync(run)
+        # one heartbeat per peer and second would be several per node-second
+        self.assertLess(delivered[CommandType.PING] / 6 / 100, 0.1)
+
+    def test_cancelled_timers_cost_no_wall_time(self):
+        """Virtual time skips past timers that were cancelled"""
+        async def run():
+            self.io_loop.call_later(2, lambda: None)
+            self.io_loop.remove_timeout(self.io_loop.call_later(0.1, lambda: None))
+            await gen.sleep(3)
+
+        started = time.monotonic()
+        self.io_loop.run_sync(run)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_suggested_successor_before_join_is_ignored(self):
+        """A node that hasn't joined yet turns successor suggestions away"""
+        node, other = self.simulator.new_node(), self.simulator.new_node()
+
+        self.io_loop.run_sync(lambda: node.suggest_successor(get_remote(other.address)))
+        self.assertEqual((node.finger[0], node.successors), (None, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
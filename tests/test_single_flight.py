@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from core.context import deadline_scope, time_left
+from core.singleflight import SingleFlight, single_flight
+
+
+class Peer:
+    def __init__(self):
+        self.in_flight = SingleFlight()
+        self.calls = []
+
+    @single_flight
+    async def find_successor(self, identifier):
+        self.calls.append(identifier)
+        await gen.sleep(0.01)
+        if identifier < 0:
+            raise ValueError(identifier)
+
+        return identifier + 1
+
+    @single_flight
+    async def budget(self):
+        await gen.sleep(0.01)
+
+        return time_left()
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=True)
+        self.peer = Peer()
+
+    def tearDown(self):
+        self.io_loop.close(all_fds=True)
+
+    def test_concurrent_callers_share_one_call(self):
+        """Callers asking the same question at once get the answer of a single call"""
+        async def run():
+            return await gen.multi([self.peer.find_successor(5) for _ in range(4)] + [self.peer.find_successor(6)])
+
+        self.assertEqual(self.io_loop.run_sync(run), [6, 6, 6, 6, 7])
+        self.assertEqual(sorted(self.peer.calls), [5, 6])
+
+    def test_finished_call_is_not_reused(self):
+        """A caller arriving after the call finished makes a call of its own"""
+        async def run():
+            return [await self.peer.find_successor(5), await self.peer.find_successor(5)]
+
+        self.assertEqual(self.io_loop.run_sync(run), [6, 6])
+        self.assertEqual(self.peer.calls, [5, 5])
+
+    def test_impatient_caller_leaves_the_call_running(self):
+        """A caller giving up cancels neither the call nor the others waiting on it"""
+        async def run():
+            impatient = asyncio.wait_for(self.peer.find_successor(5), 0.001)
+            patient = self.peer.find_successor(5)
+            results = await asyncio.gather(impatient, patient, return_exceptions=True)
+
+            return [type(result) if isinstance(result, Exception) else result for result in results]
+
+        self.assertEqual(self.io_loop.run_sync(run), [asyncio.TimeoutError, 6])
+        self.assertEqual(self.peer.calls, [5])
+
+    def test_call_runs_under_the_longest_deadline(self):
+        """The shared call is bound by the deadline of its most patient caller, not by the first one's"""
+        async def ask(seconds):
+            with deadline_scope(seconds):
+                return await self.peer.budget()
+
+        async def run():
+            return await gen.multi([ask(1), ask(5)]), await gen.multi([ask(1), ask(None)])
+
+        (short, long), unbounded = self.io_loop.run_sync(run)
+        self.assertEqual(short, long)
+        self.assertGreater(short, 4)
+        self.assertEqual(unbounded, [None, None])
+
+    def test_failure_reaches_every_caller(self):
+        """Every caller sharing a failed call gets its exception"""
+        async def run():
+            results = await asyncio.gather(*[self.peer.find_successor(-1) for _ in range(3)], return_exceptions=True)
+
+            return [type(result) for result in results]
+
+        self.assertEqual(self.io_loop.run_sync(run), [ValueError] * 3)
+        self.assertEqual(self.peer.calls, [-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import socket
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+
+from core.exceptions import HTTPConnection
+from core.stream import HEADER, StreamConnection, encode_frame, read_frame
+
+
+class FramingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=True)
+        first, second = socket.socketpair()
+        self.near, self.far = IOStream(first), IOStream(second)
+
+    def tearDown(self):
+        self.near.close()
+        self.far.close()
+        self.io_loop.close(all_fds=True)
+
+    def test_frames_round_trip(self):
+        """Frames written back to back are read one at a time, ids and all"""
+        async def run():
+            await self.near.write(encode_frame(1, {'cmd': 'PING'}) + encode_frame(7, {'data': ['é', None]}))
+
+            return [await read_frame(self.far), await read_frame(self.far)]
+
+        self.assertEqual(self.io_loop.run_sync(run), [(1, {'cmd': 'PING'}), (7, {'data': ['é', None]})])
+
+    def test_torn_frame_is_not_read(self):
+        """A frame cut short by a closed connection is never handed out"""
+        async def run():
+            frame = encode_frame(3, {'cmd': 'GET_SUCCESSOR'})
+            await self.near.write(frame[:HEADER.size + 4])
+            self.near.close()
+
+            with self.assertRaises(StreamClosedError):
+                await read_frame(self.far)
+
+        self.io_loop.run_sync(run)
+
+    def test_torn_response_fails_the_request(self):
+        """Requests waiting on a connection that breaks mid-frame fail instead of hanging"""
+        async def run():
+            connection = StreamConnection(self.near)
+            request = connection.request({'cmd': 'PING'})
+
+            async def answer():
+                request_id, _ = await read_frame(self.far)
+                await self.far.write(encode_frame(request_id, {'data': True})[:-2])
+                self.far.close()
+
+            with self.assertRaises(HTTPConnection):
+                await gen.multi([request, answer()])
+
+            return connection.closed(), connection.pending
+
+        self.assertEqual(self.io_loop.run_sync(run), (True, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
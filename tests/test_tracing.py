@@ -0,0 +1,71 @@
+import unittest
+
+from tornado import gen
+from tornado.options import options
+
+from core.tracing import Span, SpanBuffer, recording, spans
+from tests.base import SimulatorTestCase
+
+
+class TracingTestCase(SimulatorTestCase):
+    jitter = 0
+    seed = 3
+    saved_options = ('lookup', 'trace_lookups')
+
+    def tearDown(self):
+        super().tearDown()
+        spans.clear()
+
+    def test_recursive_lookup_is_one_trace(self):
+        """Every hop of a forwarded lookup hangs off the span that sent it"""
+        async def run():
+            self.simulator.build(16)
+            await gen.sleep(5)
+            await self.simulator.stop()
+
+            options.lookup = 'recursive'
+            options.trace_lookups = 1.0
+            spans.clear()
+            node = next(iter(self.simulator.nodes.values()))
+            node.lookup_cache.clear()
+            # the predecessor's key is the farthest away
+            await node.find_successor(node.predecessor.identifier())
+
+        self.io_loop.run_sync(run)
+
+        traced = spans.find()
+        by_id = {span.span_id: span for span in traced}
+        roots = [span for span in traced if span.parent_id is None]
+        self.assertEqual([span.name for span in roots], ['find_successor'])
+        self.assertEqual({span.trace_id for span in traced}, {roots[0].trace_id})
+
+        servers = [span for span in traced if span.kind == 'server']
+        self.assertGreater(len(servers), 1)
+        for span in servers:
+            # served by the peer the client span sent it to
+            self.assertEqual(by_id[span.parent_id].kind, 'client')
+            self.assertEqual(by_id[span.parent_id].attributes['peer'], span.node)
+
+    def test_buffer_keeps_the_latest_spans(self):
+        """Old spans fall off the end of the buffer"""
+        buffer = SpanBuffer(3)
+        for i in range(5):
+            buffer.record(Span(f'lookup{i}', 'internal', 'node'))
+
+        self.assertEqual([span.name for span in buffer.find()], ['lookup2', 'lookup3', 'lookup4'])
+
+    def test_otlp_export_links_spans(self):
+        """The OTLP export keeps the parent of every span"""
+        with recording(Span('find_successor', 'internal', 'node')) as root:
+            with recording(root.child('PING', 'client', peer='other')):
+                pass
+
+        exported = spans.to_otlp(root.trace_id)['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual([span['name'] for span in exported], ['PING', 'find_successor'])
+        self.assertEqual(exported[0]['parentSpanId'], root.span_id)
+        self.assertEqual(exported[0]['kind'], 3)
+        self.assertNotIn('parentSpanId', exported[1])
+
+
+if __name__ == '__main__':
+    unittest.main()